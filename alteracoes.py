@@ -0,0 +1,195 @@
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, inspect, select, delete, insert, Boolean, Integer
+from sqlalchemy.orm import Session
+
+from models import db, Turma, Aula, ProfessorAdjunto, Alteracao, CorteAlteracao
+
+# Quantas alterações o /api/changes devolve por chamada
+LIMITE_POR_PAGINA = 500
+
+ENTIDADES = {Aula: 'aula', Turma: 'turma', ProfessorAdjunto: 'professor'}
+
+
+def _valor(coluna, valor):
+    """Valor como ficou gravado: o atributo pode ainda ter o texto do formulário ("1")."""
+    if valor is None:
+        return None
+    if isinstance(coluna.type, Boolean):
+        return bool(int(valor)) if isinstance(valor, str) else bool(valor)
+    if isinstance(coluna.type, Integer):
+        return int(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+def _json(dados):
+    return json.dumps(dados, ensure_ascii=False, separators=(',', ':'))
+
+
+def _dados(obj):
+    """Campos da linha (só colunas, sem carregar relacionamentos) prontos para JSON."""
+    return {
+        attr.key: _valor(attr.columns[0], getattr(obj, attr.key))
+        for attr in inspect(obj).mapper.column_attrs
+    }
+
+
+def _dono(obj):
+    if isinstance(obj, Aula):
+        return obj.professor_id
+    return obj.user_id
+
+
+def _registros(session, conn):
+    registros = []
+    sem_dono = []
+    agora = datetime.now()
+
+    for conjunto, operacao in ((session.new, 'upsert'), (session.dirty, 'upsert'), (session.deleted, 'delete')):
+        for obj in list(conjunto):
+            entidade = ENTIDADES.get(type(obj))
+            if entidade is None:
+                continue
+            if conjunto is session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            registro = {
+                'user_id': _dono(obj),
+                'entidade': entidade,
+                'entidade_id': obj.id,
+                'operacao': operacao,
+                'dados': _json(_dados(obj)) if operacao == 'upsert' else None,
+                'criado_em': agora,
+            }
+            registros.append(registro)
+            if registro['user_id'] is None:
+                sem_dono.append((registro, obj.turma_id))
+
+    # Aulas antigas sem professor_id: o dono vem da turma
+    if sem_dono:
+        tabela = Turma.__table__
+        donos = dict(conn.execute(
+            select(tabela.c.id, tabela.c.user_id).where(tabela.c.id.in_({t for _, t in sem_dono}))
+        ).all())
+        for registro, turma_id in sem_dono:
+            registro['user_id'] = donos.get(turma_id)
+    return [r for r in registros if r['user_id'] is not None]
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_alteracoes(session, flush_context):
+    # Mesma transação da escrita: o log nunca mostra algo que não foi gravado (e vice-versa)
+    if not any(type(obj) in ENTIDADES for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        return
+    conn = session.connection(bind_arguments={'mapper': Alteracao})
+    registros = _registros(session, conn)
+    if registros:
+        conn.execute(insert(Alteracao.__table__), registros)
+
+
+def registrar_aulas_movidas(conn, tabela, turma_ids, operacao):
+    """
+    Log das aulas que sincronizar_camadas move entre aula e aula_arquivada por fora
+    do ORM: para o feed, arquivar é apagar ('delete', chamar antes de mover) e
+    reativar a turma é criar de novo ('upsert', chamar depois, lendo da tabela aula).
+    """
+    turma = Turma.__table__
+    linhas = conn.execute(
+        select(tabela, turma.c.user_id.label('_dono'))
+        .join(turma, tabela.c.turma_id == turma.c.id)
+        .where(tabela.c.turma_id.in_(turma_ids))
+    ).mappings().all()
+    if not linhas:
+        return
+    agora = datetime.now()
+    conn.execute(insert(Alteracao.__table__), [{
+        'user_id': linha['_dono'],
+        'entidade': ENTIDADES[Aula],
+        'entidade_id': linha['id'],
+        'operacao': operacao,
+        'dados': _json({c.name: _valor(c, linha[c.name]) for c in tabela.columns}) if operacao == 'upsert' else None,
+        'criado_em': agora,
+    } for linha in linhas])
+
+
+def _ultimo_cursor(user_id):
+    ultimo = db.session.execute(
+        select(func.max(Alteracao.id)).where(Alteracao.user_id == user_id)
+    ).scalar()
+    corte = db.session.execute(
+        select(CorteAlteracao.ultimo_id_removido).where(CorteAlteracao.user_id == user_id)
+    ).scalar()
+    return max(ultimo or 0, corte or 0), corte or 0
+
+
+def alteracoes_desde(user_id, cursor=None, limite=LIMITE_POR_PAGINA):
+    """
+    Alterações do usuário depois do cursor. Sem cursor, devolve só o cursor atual
+    (o cliente carrega a página inteira e passa a acompanhar daí). Se o cursor for
+    anterior ao que a retenção já apagou (ou de outro banco), pede recarga completa.
+    Várias alterações da mesma entidade na página viram só a última.
+    """
+    ultimo, corte = _ultimo_cursor(user_id)
+    if cursor is None:
+        return {'cursor': ultimo, 'alteracoes': [], 'mais': False}
+    if cursor < corte or cursor > ultimo:
+        return {'cursor': ultimo, 'alteracoes': [], 'mais': False, 'recarregar': True}
+
+    linhas = db.session.execute(
+        select(Alteracao.id, Alteracao.entidade, Alteracao.entidade_id, Alteracao.operacao, Alteracao.dados)
+        .where(Alteracao.user_id == user_id, Alteracao.id > cursor)
+        .order_by(Alteracao.id.asc())
+        .limit(limite + 1)
+    ).all()
+    mais = len(linhas) > limite
+    linhas = linhas[:limite]
+
+    compactadas = {}
+    for id_, entidade, entidade_id, operacao, dados in linhas:
+        compactadas.pop((entidade, entidade_id), None)
+        compactadas[(entidade, entidade_id)] = {
+            'entidade': entidade,
+            'id': entidade_id,
+            'operacao': operacao,
+            'dados': json.loads(dados) if dados else None,
+        }
+    return {
+        'cursor': linhas[-1][0] if linhas else cursor,
+        'alteracoes': list(compactadas.values()),
+        'mais': mais,
+    }
+
+
+def compactar_alteracoes(retencao_dias=30, user_id=None):
+    """
+    Compactação: de cada entidade fica só a alteração mais recente (quem está atrás
+    recebe direto o estado final). Retenção: apaga o que passou de `retencao_dias`
+    e guarda o corte, para os clientes parados há mais tempo recarregarem a página.
+    Retorna quantas linhas foram apagadas.
+    """
+    tabela = Alteracao.__table__
+    corte = CorteAlteracao.__table__
+    conn = db.session.connection(bind_arguments={'mapper': Alteracao, 'escrita': True})
+
+    ultimas = select(func.max(tabela.c.id)).group_by(tabela.c.user_id, tabela.c.entidade, tabela.c.entidade_id)
+    limpeza = delete(tabela).where(tabela.c.id.not_in(ultimas))
+    if user_id is not None:
+        limpeza = limpeza.where(tabela.c.user_id == user_id)
+    apagadas = conn.execute(limpeza).rowcount
+
+    limite = datetime.now() - timedelta(days=retencao_dias)
+    antigas = select(tabela.c.user_id, func.max(tabela.c.id)).where(tabela.c.criado_em < limite)
+    if user_id is not None:
+        antigas = antigas.where(tabela.c.user_id == user_id)
+    cortes = dict(conn.execute(antigas.group_by(tabela.c.user_id)).all())
+    if cortes:
+        conn.execute(delete(corte).where(corte.c.user_id.in_(cortes.keys())))
+        conn.execute(insert(corte), [{'user_id': u, 'ultimo_id_removido': i} for u, i in cortes.items()])
+        apagadas += conn.execute(
+            delete(tabela).where(tabela.c.user_id.in_(cortes.keys()), tabela.c.criado_em < limite)
+        ).rowcount
+
+    db.session.commit()
+    return apagadas
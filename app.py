@@ -1,8 +1,9 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, abort, Response, stream_with_context, session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload, contains_eager
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 import calendar
 import csv
 import math
@@ -10,15 +11,35 @@ import json
 import io
 import atexit
 import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import click
 from dotenv import load_dotenv
 
 # Importando o Agendador de Tarefas
 from apscheduler.schedulers.background import BackgroundScheduler
 
 # Importando modelos e serviço de drive
-from models import db, User, Turma, Aula, ProfessorAdjunto
-from drive_service import DriveService
+from models import db, User, Turma, Aula, AulaArquivada, ProfessorAdjunto, ResumoTurma, TokenCalendario, criar_indices_faltantes, criar_colunas_faltantes, criar_autoincremento_aula
+from drive_service import DriveService, ErroIntegridade
+from backup_local import LocalBackupService
+from drive_tasks import DriveTaskRunner
+from resumo_turmas import resumos_do_usuario, reconstruir_resumos, atualizar_resumos_vencidos, totais
+from conflitos import detectar_conflitos
+from arquivo_turmas import sincronizar_camadas, aulas_das_duas_camadas, arquivar_inativas
+from versao_dados import versao_do_usuario
+from visao_anual import contagens_do_ano, montar_ano
+from alteracoes import alteracoes_desde, compactar_alteracoes
+from retencao_backups import ler_politica, aplicar_retencao
+from calendario_ics import gerar_ics
+from importacao_backup import ler_backup, registros_do_dicionario, importar_registros, email_no_inicio, BackupDeOutroUsuario, chave_aula, chaves_existentes
+import tenants
+from tenants import tenant
+import replica
+import fragmentos
+from replica import somente_leitura, leitura
 
 # Carrega variáveis do arquivo .env (se existir)
 load_dotenv()
@@ -38,18 +59,87 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
     'sqlite:///planner.db'
 )
 
+# Pool dedicado às chamadas do Google Drive (não ocupa as threads do gunicorn)
+app.config['DRIVE_MAX_WORKERS'] = int(os.getenv('DRIVE_MAX_WORKERS', '2'))
+app.config['DRIVE_MAX_PENDENTES'] = int(os.getenv('DRIVE_MAX_PENDENTES', '20'))
+# Transferências com o Drive: tamanho de cada pedaço (múltiplo de 256 KiB), quanto do
+# download fica em memória antes de ir para disco e tentativas/retomadas por arquivo
+app.config['DRIVE_CHUNK_SIZE'] = int(os.getenv('DRIVE_CHUNK_SIZE', str(4 * 1024 * 1024)))
+app.config['DRIVE_SPOOL_MAX'] = int(os.getenv('DRIVE_SPOOL_MAX', str(8 * 1024 * 1024)))
+app.config['DRIVE_TENTATIVAS'] = int(os.getenv('DRIVE_TENTATIVAS', '5'))
+app.config['DRIVE_RETOMADAS'] = int(os.getenv('DRIVE_RETOMADAS', '3'))
+
+# Particionamento por professor: vazio = banco único; "usuario" = um SQLite por usuário;
+# "bucket" = TENANT_BUCKETS arquivos compartilhados (user_id % N). O DATABASE_URL vira o
+# "diretório" (usuários, tokens, operações) e os arquivos ficam em TENANT_DIR.
+app.config['TENANT_MODE'] = os.getenv('TENANT_MODE', '')
+app.config['TENANT_BUCKETS'] = int(os.getenv('TENANT_BUCKETS', '16'))
+app.config['TENANT_DIR'] = os.getenv('TENANT_DIR')
+# Quantos usuários o backup automático processa ao mesmo tempo
+app.config['BACKUP_PARALELO'] = int(os.getenv('BACKUP_PARALELO', '4'))
+# Por quantos dias o log de alterações (/api/changes) é mantido
+app.config['ALTERACOES_RETENCAO_DIAS'] = int(os.getenv('ALTERACOES_RETENCAO_DIAS', '30'))
+# Quantos backups manter no Drive: um por hora/dia/mês dentro de cada janela
+app.config['BACKUP_RETENCAO'] = ler_politica(os.getenv('BACKUP_RETENCAO', 'horas=48,dias=30,meses=12'))
+
+# Separação leitura/escrita: rotas marcadas com @somente_leitura leem de DATABASE_READ_URL
+# (URL de réplica ou "sqlite-ro"); escritas sempre no primário. Após um POST, o mesmo
+# navegador lê do primário por READ_STICKY_SECONDS.
+app.config['DATABASE_READ_URL'] = os.getenv('DATABASE_READ_URL', '')
+app.config['READ_STICKY_SECONDS'] = float(os.getenv('READ_STICKY_SECONDS', '5'))
+
+tenants.configurar(app)
+replica.configurar(app)
+
+# Templates: bytecode compilado em disco (JINJA_CACHE_DIR, padrão instance/jinja_cache) e
+# cache em memória dos cards de aula e do modal (FRAGMENTOS_MAX itens; 0 desliga)
+app.config['JINJA_CACHE_DIR'] = os.getenv('JINJA_CACHE_DIR')
+app.config['FRAGMENTOS_MAX'] = int(os.getenv('FRAGMENTOS_MAX', '5000'))
+fragmentos.configurar(app)
+
 db.init_app(app)
 
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
 
-drive_service = DriveService()
+# BACKUP_BACKEND=local grava os backups numa pasta (BACKUP_LOCAL_DIR) em vez do Google Drive
+if os.getenv('BACKUP_BACKEND', 'drive').lower() == 'local':
+    drive_service = LocalBackupService(os.getenv('BACKUP_LOCAL_DIR') or os.path.join(app.instance_path, 'backups'))
+else:
+    drive_service = DriveService(
+        chunk_size=app.config['DRIVE_CHUNK_SIZE'],
+        spool_max=app.config['DRIVE_SPOOL_MAX'],
+        tentativas=app.config['DRIVE_TENTATIVAS'],
+        retomadas=app.config['DRIVE_RETOMADAS'],
+    )
+drive_tasks = DriveTaskRunner(app)
 
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
+@app.before_request
+def ativar_tenant():
+    # No modo tenant, toda consulta a turmas/aulas da requisição vai para o banco do usuário logado
+    if tenants.modo_ativo() and current_user.is_authenticated:
+        tenants.definir_tenant_da_requisicao(current_user.id)
+
+app.teardown_request(tenants.encerrar_tenant_da_requisicao)
+
+@app.before_request
+def avisar_sincronizacao_login():
+    # Resultado da sincronização do login (em segundo plano): vira flash na próxima página
+    op_id = session.get('_sincronizacao_login')
+    if not op_id or not current_user.is_authenticated:
+        return
+    op = drive_tasks.status(op_id, current_user.id)
+    if op and op['status'] in ('pendente', 'executando'):
+        return
+    session.pop('_sincronizacao_login', None)
+    if op and op['status'] == 'concluida' and op['resultado']:
+        flash(op['mensagem'], 'success')
+
 # ==========================================
 # ROTAS DE AUTENTICAÇÃO E DASHBOARD (Mantidas iguais)
 # ==========================================
@@ -85,22 +175,32 @@ def sincronizar_ultimo_backup(user):
     Busca o último backup do usuário no Google Drive e aplica a sincronização
     (importa turmas/aulas que ainda não existem). Retorna (sucesso, mensagem).
     """
-    files = drive_service.list_backups()
+    # O dono vem nas appProperties: a busca já traz só os backups deste usuário
+    files = drive_service.list_backups(user_id=user.id)
+    legados = False
+    if not files:
+        # Backups gravados antes das appProperties não têm dono
+        files = [f for f in drive_service.list_backups() if _dono_do_backup(f) is None]
+        legados = True
     if not files:
         return False, None
 
     for f in files:
-        content = drive_service.download_file_content(f['id'])
-        if not content:
-            continue
         try:
-            dados = json.loads(content)
-            # Só restaura se o backup for deste usuário (mesmo email)
-            if dados.get('email') != user.email:
+            # Backup sem dono: confere o email com um pedaço do início antes de
+            # baixar (e conferir o checksum de) o arquivo inteiro
+            if legados and email_no_inicio(drive_service.ler_inicio(f['id']) or b'') != user.email:
+                continue
+            arquivo = drive_service.open_download_stream(f['id'])
+            if not arquivo:
                 continue
-            processar_importacao(dados, user.id)
+            with arquivo:
+                importar_registros(ler_backup(arquivo), user.id, email_esperado=user.email)
             return True, f.get('name', 'backup')
-        except (json.JSONDecodeError, Exception):
+        except BackupDeOutroUsuario:
+            continue
+        except Exception:
+            db.session.rollback()
             continue
     return False, None
 
@@ -115,15 +215,13 @@ def login():
         
         if user and check_password_hash(user.password, password):
             login_user(user)
-            # Sincronização automática: busca último backup do usuário no Drive
-            try:
-                ok, nome = sincronizar_ultimo_backup(user)
-                if ok:
-                    flash(f'Login realizado. Dados sincronizados com o backup "{nome}".', 'success')
-                else:
-                    flash('Login realizado com sucesso!', 'success')
-            except Exception:
-                flash('Login realizado com sucesso!', 'success')
+            # Sincronização automática com o último backup do Drive, no pool do Drive:
+            # o download (com checksum) não segura a thread HTTP do login
+            with tenant(user.id):
+                op_id = drive_tasks.submeter(user.id, 'sincronizar', _tarefa_sincronizar, user.id)
+            if op_id:
+                session['_sincronizacao_login'] = op_id
+            flash('Login realizado com sucesso!', 'success')
             return redirect(url_for('dashboard'))
         else:
             flash('Email ou senha incorretos.', 'error')
@@ -138,6 +236,7 @@ def logout():
 
 @app.route('/')
 @login_required
+@somente_leitura
 def dashboard():
     # Código do dashboard mantido igual ao original enviado
     view_mode = request.args.get('view', 'semanal')
@@ -148,8 +247,16 @@ def dashboard():
 
     hoje = datetime.now()
     dias_calendario = []
+    meses_ano = []
     
-    if view_mode == 'mensal':
+    if view_mode == 'anual':
+        # Só contagens por dia (GROUP BY), sem carregar as aulas
+        ano_alvo = hoje.year + offset
+        contagens = contagens_do_ano(current_user.id, ano_alvo)
+        meses_ano = montar_ano(ano_alvo, contagens)
+        current_date_display = str(ano_alvo)
+
+    elif view_mode == 'mensal':
         mes_alvo = hoje.month + offset
         ano_alvo = hoje.year + ((mes_alvo - 1) // 12)
         mes_alvo = ((mes_alvo - 1) % 12) + 1
@@ -186,11 +293,13 @@ def dashboard():
         end_date = dias_calendario[-1]['date']
         current_date_display = f"Semana de {start_date.strftime('%d/%m')} a {end_date.strftime('%d/%m')}"
 
-    aulas = Aula.query.filter(
-        Aula.turma.has(user_id=current_user.id, ativa=True), 
-        Aula.data >= start_date,
-        Aula.data <= end_date
-    ).all()
+    aulas = []
+    if dias_calendario:
+        aulas = Aula.query.options(joinedload(Aula.turma)).filter(
+            Aula.turma.has(user_id=current_user.id, ativa=True), 
+            Aula.data >= start_date,
+            Aula.data <= end_date
+        ).all()
 
     layout_data = {}
     for item in dias_calendario:
@@ -204,6 +313,7 @@ def dashboard():
 
     turmas = Turma.query.filter_by(user_id=current_user.id, ativa=True).all()
     professores_lista = ProfessorAdjunto.query.filter_by(user_id=current_user.id).all()
+    resumo_geral = totais(resumos_do_usuario(current_user.id, somente_ativas=True).values())
 
     return render_template(
         'dashboard.html',
@@ -212,10 +322,15 @@ def dashboard():
         hoje=hoje,
         dias_calendario=dias_calendario,
         layout_data=layout_data,
+        meses_ano=meses_ano,
         dias_semana=['Dom', 'Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb'],
         current_date_display=current_date_display,
         turmas=turmas,
-        professores=professores_lista
+        professores=professores_lista,
+        resumo_geral=resumo_geral,
+        # Dados do modal de edição já na página: abrir uma aula não faz requisição
+        aulas_prefetch={a.id: a.to_json() for a in aulas},
+        versao_dados=versao_do_usuario(current_user.id)[0]
     )
 
 @app.route('/criar_aula', methods=['POST'])
@@ -230,12 +345,25 @@ def criar_aula():
         if prof_ministrante and prof_ministrante != 'me':
             ministrante_id_db = int(prof_ministrante)
 
+        data_dt = datetime.strptime(data_str, '%Y-%m-%d').date()
+        conflitos = detectar_conflitos(current_user.id, [{
+            'data': data_dt,
+            'turno': request.form.get('turno'),
+            'sala': request.form.get('sala'),
+            'unidade_predio': request.form.get('unidade_predio'),
+            'ministrante_id': ministrante_id_db
+        }])
+        if conflitos:
+            for msg in conflitos[0]:
+                flash(f'Conflito de agenda: {msg}.', 'error')
+            return redirect(request.referrer or url_for('dashboard'))
+
         nova = Aula(
             turma_id=turma_id,
             professor_id=current_user.id,
             ministrante_id=ministrante_id_db,
             titulo=request.form.get('titulo'),
-            data=datetime.strptime(data_str, '%Y-%m-%d').date(),
+            data=data_dt,
             turno=request.form.get('turno'),
             status=request.form.get('status', 'Planejando'),
             numero_aula=request.form.get('numero_aula', 0),
@@ -260,9 +388,11 @@ def criar_aula():
 # ... Copiar rotas de turma do arquivo original ...
 @app.route('/turmas')
 @login_required
+@somente_leitura
 def listar_turmas():
     turmas = Turma.query.filter_by(user_id=current_user.id).all()
-    return render_template('turmas.html', turmas=turmas)
+    resumos = resumos_do_usuario(current_user.id)
+    return render_template('turmas.html', turmas=turmas, resumos=resumos, resumo_geral=totais(resumos.values()))
 
 @app.route('/turmas/nova', methods=['POST'])
 @login_required
@@ -297,6 +427,8 @@ def editar_turma():
             turma.unidade_curricular = request.form.get('unidade_curricular')
             turma.link_diario = request.form.get('link_diario')
             turma.ativa = True if request.form.get('ativa') else False
+            # Desativada: aulas vão para o arquivo; reativada: voltam para a tabela principal
+            sincronizar_camadas([turma.id])
             
             db.session.commit()
             flash('Turma atualizada!', 'success')
@@ -310,6 +442,7 @@ def toggle_status_turma(id):
     turma = db.session.get(Turma, id)
     if turma and turma.user_id == current_user.id:
         turma.ativa = not turma.ativa
+        sincronizar_camadas([turma.id])
         db.session.commit()
         status = "ativada" if turma.ativa else "desativada"
         flash(f'Turma {status} com sucesso.', 'success')
@@ -320,6 +453,11 @@ def toggle_status_turma(id):
 def excluir_turma(id):
     turma = db.session.get(Turma, id)
     if turma and turma.user_id == current_user.id:
+        # Os links do feed da turma saem antes (o id pode ser reaproveitado por uma
+        # turma nova). Commits separados: com TENANT_MODE os tokens ficam no diretório
+        # e a turma no banco do tenant; se a segunda parte falhar, só o link se perde.
+        TokenCalendario.query.filter_by(user_id=current_user.id, turma_id=id).delete()
+        db.session.commit()
         db.session.delete(turma)
         db.session.commit()
         flash('Turma removida.', 'success')
@@ -327,12 +465,13 @@ def excluir_turma(id):
 
 @app.route('/turmas/imprimir/<int:turma_id>')
 @login_required
+@somente_leitura
 def imprimir_turma(turma_id):
     turma = db.session.get(Turma, turma_id)
     if not turma or turma.user_id != current_user.id:
         flash('Turma não encontrada ou sem permissão.', 'error')
         return redirect(url_for('gerenciar_aulas'))
-    aulas = sorted(turma.aulas, key=lambda x: x.data)
+    aulas = aulas_das_duas_camadas(turma)
     for index, aula in enumerate(aulas, start=1):
         aula.numero_aula = index
     return render_template('imprimir_turma.html', turma=turma, aulas=aulas, hoje=datetime.now())
@@ -345,12 +484,44 @@ def imprimir_turma(turma_id):
 @app.route('/get_aula/<int:id>')
 @app.route('/aula/detalhes/<int:id>')
 @login_required
+@somente_leitura
 def get_aula(id):
     aula = db.session.get(Aula, id)
     if not aula or aula.turma.user_id != current_user.id:
         return {'error': 'Acesso negado'}, 403
     return aula.to_json()
 
+# Limite de ids por chamada do lote (a URL também tem limite de tamanho)
+MAX_AULAS_POR_LOTE = 200
+
+@app.route('/api/aulas/batch')
+@login_required
+@somente_leitura
+def get_aulas_lote():
+    """
+    Várias aulas numa só consulta (com a turma no mesmo JOIN): ?ids=1,2,3.
+    Retorna {id: aula}; ids de outros usuários ou inexistentes são omitidos.
+    """
+    ids = set()
+    for parte in request.args.getlist('ids'):
+        for valor in parte.split(','):
+            valor = valor.strip()
+            # isdigit() aceita dígitos Unicode ("²") que o int() recusa
+            if valor.isascii() and valor.isdigit():
+                ids.add(int(valor))
+    if len(ids) > MAX_AULAS_POR_LOTE:
+        return {'error': f'Máximo de {MAX_AULAS_POR_LOTE} aulas por chamada'}, 400
+    if not ids:
+        return jsonify({})
+
+    aulas = (
+        Aula.query.join(Aula.turma)
+        .options(contains_eager(Aula.turma))
+        .filter(Aula.id.in_(ids), Turma.user_id == current_user.id)
+        .all()
+    )
+    return jsonify({a.id: a.to_json() for a in aulas})
+
 @app.route('/aula/editar', methods=['POST'])
 @login_required
 def editar_aula():
@@ -367,13 +538,26 @@ def editar_aula():
         if prof_ministrante and prof_ministrante != 'me':
             ministrante_id_db = int(prof_ministrante)
         
+        data_dt = datetime.strptime(request.form.get('data'), '%Y-%m-%d').date()
+        conflitos = detectar_conflitos(current_user.id, [{
+            'data': data_dt,
+            'turno': request.form.get('turno'),
+            'sala': request.form.get('sala'),
+            'unidade_predio': request.form.get('unidade_predio'),
+            'ministrante_id': ministrante_id_db
+        }], ignorar_ids={aula.id})
+        if conflitos:
+            for msg in conflitos[0]:
+                flash(f'Conflito de agenda: {msg}.', 'error')
+            return redirect(request.referrer or url_for('dashboard'))
+
         nova_turma_id = request.form.get('turma_id')
         if nova_turma_id:
             aula.turma_id = int(nova_turma_id)
 
         aula.ministrante_id = ministrante_id_db
         aula.titulo = request.form.get('titulo')
-        aula.data = datetime.strptime(request.form.get('data'), '%Y-%m-%d').date()
+        aula.data = data_dt
         aula.turno = request.form.get('turno')
         aula.status = request.form.get('status')
         aula.sala = request.form.get('sala')
@@ -403,8 +587,27 @@ def excluir_aula(id):
         flash('Aula removida.', 'success')
     return redirect(request.referrer or url_for('dashboard'))
 
+def filtrar_aulas(query, user_id, turma_filter=None, search_query=None, status_filter=None, modelo=Aula):
+    """
+    Aplica os filtros da tela Gerenciar Aulas (query já deve ter o join com Turma).
+    `modelo` permite filtrar a tabela de aulas arquivadas com os mesmos critérios.
+    """
+    query = query.filter(Turma.user_id == user_id)
+
+    if turma_filter and turma_filter != 'Todas':
+        query = query.filter(modelo.turma_id == int(turma_filter))
+    
+    if search_query:
+        query = query.filter(modelo.titulo.contains(search_query))
+  
+    if status_filter and len(status_filter) > 0:
+        query = query.filter(modelo.status.in_(status_filter))
+
+    return query
+
 @app.route('/gerenciar_aulas')
 @login_required
+@somente_leitura
 def gerenciar_aulas():
     page = request.args.get('page', 1, type=int)
     turma_filter = request.args.get('turma_id')
@@ -414,21 +617,13 @@ def gerenciar_aulas():
     per_page = 20
     offset = (page - 1) * per_page
 
-    query = Aula.query.join(Turma).filter(Turma.user_id == current_user.id)
-
-    if turma_filter and turma_filter != 'Todas':
-        query = query.filter(Aula.turma_id == int(turma_filter))
-    
-    if search_query:
-        query = query.filter(Aula.titulo.contains(search_query))
-  
-    if status_filter and len(status_filter) > 0:
-        query = query.filter(Aula.status.in_(status_filter))
+    query = filtrar_aulas(Aula.query.join(Turma), current_user.id, turma_filter, search_query, status_filter)
 
     total_items = query.count()
     total_pages = math.ceil(total_items / per_page)
     
-    aulas = query.order_by(Aula.data.asc()).limit(per_page).offset(offset).all()
+    # A query já tem o JOIN com Turma: aproveita as colunas para preencher aula.turma
+    aulas = query.options(contains_eager(Aula.turma)).order_by(Aula.data.asc()).limit(per_page).offset(offset).all()
 
     todas_turmas = Turma.query.filter_by(user_id=current_user.id, ativa=True).all()
     todos_professores = ProfessorAdjunto.query.filter_by(user_id=current_user.id).all()
@@ -444,7 +639,9 @@ def gerenciar_aulas():
         search_query=search_query,
         status_selecionados=status_filter,
         turmas=todas_turmas,
-        professores=todos_professores
+        professores=todos_professores,
+        aulas_prefetch={a.id: a.to_json() for a in aulas},
+        versao_dados=versao_do_usuario(current_user.id)[0]
     )
 
 
@@ -452,16 +649,20 @@ def gerenciar_aulas():
 # IMPORTAÇÃO DE AULAS (CSV)
 # ==========================================
 
+# Colunas do CSV de importação/exportação (mesma ordem nos dois sentidos)
+COLUNAS_CSV = [
+    'turma', 'data', 'titulo', 'turno', 'status', 'sala',
+    'unidade_predio', 'bloco_estudo', 'numero_aula', 'descricao', 'observacoes', 'link_arquivos'
+]
+LINHAS_POR_LOTE_CSV = 500
+
 @app.route('/aulas/importar/modelo')
 @login_required
 def download_modelo_importacao():
     """Gera e envia um CSV modelo para importação de aulas."""
     output = io.StringIO()
     writer = csv.writer(output)
-    writer.writerow([
-        'turma', 'data', 'titulo', 'turno', 'status', 'sala',
-        'unidade_predio', 'bloco_estudo', 'numero_aula', 'descricao', 'observacoes', 'link_arquivos'
-    ])
+    writer.writerow(COLUNAS_CSV)
     writer.writerow([
         'Nome da Turma', '2025-02-10', 'Introdução ao tema', 'Manhã', 'Planejando',
         '101', 'Bloco A', 'Bloco 1', '1', 'Conteúdo da aula', 'Obs.', ''
@@ -477,6 +678,54 @@ def download_modelo_importacao():
     )
 
 
+@app.route('/aulas/exportar')
+@login_required
+@somente_leitura
+def exportar_aulas():
+    """Exporta as aulas filtradas no mesmo formato aceito por importar_aulas."""
+    # Lê as duas camadas (aulas e aulas arquivadas) numa só consulta ordenada
+    camadas = [
+        filtrar_aulas(
+            db.select(
+                Turma.nome, m.data, m.titulo, m.turno, m.status, m.sala,
+                m.unidade_predio, m.bloco_estudo, m.numero_aula, m.descricao,
+                m.observacoes, m.link_arquivos, m.id
+            ).join(Turma, m.turma_id == Turma.id),
+            current_user.id,
+            request.args.get('turma_id'),
+            request.args.get('search'),
+            request.args.getlist('status'),
+            modelo=m
+        )
+        for m in (Aula, AulaArquivada)
+    ]
+    uniao = db.union_all(*camadas).subquery()
+    consulta = db.session.execute(
+        db.select(*list(uniao.c)[:-1]).order_by(uniao.c.data.asc(), uniao.c.id.asc())
+        .execution_options(yield_per=LINHAS_POR_LOTE_CSV)
+    )
+
+    def gerar():
+        # Cada pedaço da resposta leva um lote de linhas; a memória não cresce com o total
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM, igual ao modelo (utf-8-sig)
+        writer.writerow(COLUNAS_CSV)
+        for n, linha in enumerate(consulta, start=1):
+            linha = list(linha)
+            linha[1] = linha[1].strftime('%Y-%m-%d')
+            writer.writerow(['' if v is None else v for v in linha])
+            if n % LINHAS_POR_LOTE_CSV == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    resposta = Response(stream_with_context(tenants.iterar_com_tenant(current_user.id, gerar())), mimetype='text/csv; charset=utf-8')
+    resposta.headers['Content-Disposition'] = f'attachment; filename=aulas_{datetime.now().strftime("%Y%m%d")}.csv'
+    return resposta
+
+
 @app.route('/aulas/importar', methods=['POST'])
 @login_required
 def importar_aulas():
@@ -515,6 +764,7 @@ def importar_aulas():
 
         importadas = 0
         erros = []
+        pendentes = []  # (linha, Aula) validadas, aguardando a checagem de conflitos
 
         for idx, row in enumerate(reader, start=2):
             # Monta dict com chaves normalizadas
@@ -570,19 +820,50 @@ def importar_aulas():
                 observacoes=row_norm.get('observacoes') or None,
                 link_arquivos=row_norm.get('link_arquivos') or None,
             )
+            pendentes.append((idx, aula))
+
+        # Aulas que já existem (mesma chave da restauração de backup, ver chave_aula)
+        # são ignoradas; assim reimportar um CSV exportado não duplica nada.
+        existentes = chaves_existentes([a for _, a in pendentes])
+        ja_existentes = 0
+        novas = []
+        for idx, aula in pendentes:
+            chave = chave_aula(aula)
+            if chave in existentes:
+                ja_existentes += 1
+                continue
+            existentes.add(chave)
+            novas.append((idx, aula))
+        pendentes = novas
+
+        # Checagem de conflitos do arquivo inteiro numa única consulta
+        conflitos = detectar_conflitos(current_user.id, [
+            {'data': a.data, 'turno': a.turno, 'sala': a.sala, 'unidade_predio': a.unidade_predio,
+             'ministrante_id': a.ministrante_id, 'titulo': a.titulo}
+            for _, a in pendentes
+        ])
+        for pos, (idx, aula) in enumerate(pendentes):
+            if pos in conflitos:
+                for msg in conflitos[pos]:
+                    erros.append(f'Linha {idx}: conflito de agenda, {msg}.')
+                continue
             db.session.add(aula)
             importadas += 1
 
+        # Aulas importadas para turmas desativadas vão direto para o arquivo
+        sincronizar_camadas({t.id for t in turmas_usuario.values() if not t.ativa} & {a.turma_id for _, a in pendentes})
         db.session.commit()
 
         if importadas > 0:
             flash(f'{importadas} aula(s) importada(s) com sucesso.', 'success')
+        if ja_existentes:
+            flash(f'{ja_existentes} aula(s) já existente(s) foram ignoradas.', 'info')
         if erros:
             for msg in erros[:10]:
                 flash(msg, 'error')
             if len(erros) > 10:
                 flash(f'… e mais {len(erros) - 10} erro(s).', 'error')
-        if importadas == 0 and not erros:
+        if importadas == 0 and not erros and not ja_existentes:
             flash('Nenhuma linha válida para importar. Verifique o CSV.', 'warning')
 
     except Exception as e:
@@ -597,9 +878,18 @@ def importar_aulas():
 # ==========================================
 @app.route('/configuracoes')
 @login_required
+@somente_leitura
 def configuracoes():
     professores = ProfessorAdjunto.query.filter_by(user_id=current_user.id).all()
-    return render_template('configuracoes.html', professores=professores)
+    turmas = Turma.query.filter_by(user_id=current_user.id, ativa=True).all()
+    tokens = {t.turma_id: t.token for t in TokenCalendario.query.filter_by(user_id=current_user.id).all()}
+    return render_template(
+        'configuracoes.html',
+        professores=professores,
+        turmas=turmas,
+        tokens_calendario=tokens,
+        operacao_id=request.args.get('op')
+    )
 
 @app.route('/perfil/atualizar', methods=['POST'])
 @login_required
@@ -642,6 +932,7 @@ def excluir_professor(id):
 
 @app.route('/backup/download')
 @login_required
+@somente_leitura
 def download_backup():
     data = current_user.to_dict()
     json_str = json.dumps(data, indent=4, ensure_ascii=False)
@@ -653,93 +944,323 @@ def download_backup():
 @app.route('/backup/drive/upload')
 @login_required
 def upload_drive():
-    data = current_user.to_dict()
+    # A serialização é local e rápida; só o envio ao Drive vai para o pool
+    with leitura():
+        data = current_user.to_dict()
     json_str = json.dumps(data, indent=4, ensure_ascii=False)
     filename = f"backup_planner_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json"
-    success, msg = drive_service.upload_backup(filename, json_str)
-    if success:
-        flash(f'Backup "{filename}" enviado para o Google Drive!', 'success')
-    else:
-        flash(f'Erro ao enviar para o Drive: {msg}', 'error')
-    return redirect(url_for('configuracoes'))
+    op_id = drive_tasks.submeter(current_user.id, 'upload', _tarefa_upload, filename, json_str, current_user.id)
+    if not op_id:
+        flash('Muitas operações com o Drive em andamento. Tente novamente em instantes.', 'error')
+        return redirect(url_for('configuracoes'))
+    flash(f'Enviando "{filename}" para o Google Drive...', 'info')
+    return redirect(url_for('configuracoes', op=op_id))
 
 @app.route('/backup/drive/list')
 @login_required
 def list_drive_backups():
-    files = drive_service.list_backups()
-    return jsonify(files)
+    # ?todos=1 inclui também os backups antigos, gravados antes de terem dono (nunca os
+    # de outros professores); ?cursor= pega a próxima página
+    op_id = drive_tasks.submeter(
+        current_user.id, 'listar', _tarefa_listar,
+        current_user.id, request.args.get('cursor') or None, bool(request.args.get('todos'))
+    )
+    if not op_id:
+        return jsonify({'error': 'Fila do Drive cheia'}), 503
+    return jsonify({'operacao_id': op_id}), 202
 
 @app.route('/backup/drive/restore/<file_id>')
 @login_required
 def restore_drive(file_id):
-    content = drive_service.download_file_content(file_id)
-    if not content:
-        flash('Erro ao baixar arquivo do Drive.', 'error')
+    op_id = drive_tasks.submeter(current_user.id, 'restore', _tarefa_restore, file_id, current_user.id)
+    if not op_id:
+        flash('Muitas operações com o Drive em andamento. Tente novamente em instantes.', 'error')
         return redirect(url_for('configuracoes'))
+    flash('Restaurando backup do Google Drive...', 'info')
+    return redirect(url_for('configuracoes', op=op_id))
+
+@app.route('/backup/drive/status/<op_id>')
+@login_required
+def status_operacao_drive(op_id):
+    op = drive_tasks.status(op_id, current_user.id)
+    if not op:
+        return {'error': 'Operação não encontrada'}, 404
+    return jsonify(op)
+
+# Tarefas executadas no pool do Drive: retornam (sucesso, mensagem, resultado)
+def _tarefa_upload(filename, json_str, user_id):
+    success, msg = drive_service.upload_backup(filename, json_str, user_id=user_id)
+    if success:
+        return True, f'Backup "{filename}" enviado para o Google Drive!', None
+    return False, f'Erro ao enviar para o Drive: {msg}', None
+
+def _tarefa_sincronizar(user_id):
+    ok, nome = sincronizar_ultimo_backup(db.session.get(User, user_id))
+    if not ok:
+        return True, 'Nenhum backup para sincronizar.', None
+    return True, f'Dados sincronizados com o backup "{nome}".', {'backup': nome}
+
+def _dono_do_backup(arquivo):
+    """user_id (str) gravado nas appProperties; None nos backups antigos, sem dono."""
+    return (arquivo.get('appProperties') or {}).get('user_id') or None
+
+def _tarefa_listar(user_id, cursor, sem_dono=False):
+    if not sem_dono:
+        arquivos, proximo = drive_service.list_backups_page(user_id, cursor)
+    else:
+        # A API não busca por "sem a propriedade": lista tudo e descarta o que é de outro dono
+        arquivos, proximo = drive_service.list_backups_page(None, cursor, page_size=50)
+        arquivos = [a for a in arquivos if _dono_do_backup(a) in (None, str(user_id))]
+    return True, None, {'arquivos': arquivos, 'cursor': proximo}
+
+def _tarefa_restore(file_id, user_id):
+    metadados = drive_service.metadados(file_id)
+    if not metadados:
+        return False, 'Backup não encontrado.', None
+    dono = _dono_do_backup(metadados)
+    if dono is not None and dono != str(user_id):
+        return False, 'Este backup pertence a outro usuário.', None
+    # Backup antigo, sem dono: só restaura se o email gravado nele for o do usuário
+    email_esperado = None if dono else db.session.get(User, user_id).email
     try:
-        dados = json.loads(content)
-        processar_importacao(dados, current_user.id)
-        flash('Dados restaurados/sincronizados com a nuvem!', 'success')
+        arquivo = drive_service.open_download_stream(file_id)
+    except ErroIntegridade as e:
+        return False, f'Backup corrompido no download: {e}', None
+    except Exception:
+        arquivo = None
+    if not arquivo:
+        return False, 'Erro ao baixar arquivo do Drive.', None
+    try:
+        # Turmas e aulas são gravadas à medida que os pedaços chegam do Drive
+        with arquivo:
+            conflitos = importar_registros(ler_backup(arquivo), user_id, email_esperado=email_esperado)
+    except BackupDeOutroUsuario:
+        db.session.rollback()
+        return False, 'Este backup pertence a outro usuário.', None
     except Exception as e:
-        flash(f'Erro ao processar backup: {e}', 'error')
+        db.session.rollback()
+        return False, f'Erro ao processar backup: {e}', None
+    if conflitos:
+        return True, f'Dados restaurados, com {len(conflitos)} conflito(s) de agenda.', {'conflitos': conflitos[:50]}
+    return True, 'Dados restaurados/sincronizados com a nuvem!', None
+
+# ==========================================
+# CALENDÁRIO (FEED ICAL)
+# ==========================================
+
+@app.route('/calendar/token', methods=['POST'])
+@login_required
+def gerar_token_calendario():
+    """Cria (ou troca) o link secreto do feed; o link antigo deixa de funcionar."""
+    turma_id = request.form.get('turma_id', type=int)
+    if turma_id is not None:
+        turma = db.session.get(Turma, turma_id)
+        if not turma or turma.user_id != current_user.id:
+            flash('Turma não encontrada.', 'error')
+            return redirect(url_for('configuracoes'))
+
+    TokenCalendario.query.filter_by(user_id=current_user.id, turma_id=turma_id).delete()
+    db.session.add(TokenCalendario(token=secrets.token_urlsafe(32), user_id=current_user.id, turma_id=turma_id))
+    db.session.commit()
+    flash('Link do calendário gerado.', 'success')
     return redirect(url_for('configuracoes'))
 
-def processar_importacao(dados, user_id):
-    mapa_ids_turma = {}
+@app.route('/calendar/<token>.ics')
+@somente_leitura
+def calendario_feed(token):
+    # Sem login: o token no link é a credencial (apps de calendário não mandam cookie)
+    registro = db.session.get(TokenCalendario, token)
+    if not registro:
+        abort(404)
+    tenants.definir_tenant_da_requisicao(registro.user_id)
+
+    versao, atualizado_em = versao_do_usuario(registro.user_id)
+    etag = f'cal-{registro.user_id}-{registro.turma_id or "todas"}-v{versao}'
+    ultima_mod = atualizado_em.astimezone(timezone.utc).replace(microsecond=0) if atualizado_em else None
+
+    # Os clientes consultam o feed com frequência: sem mudança, responde 304 sem tocar nas aulas
+    nao_mudou = request.if_none_match.contains(etag) if request.if_none_match else (
+        ultima_mod is not None and request.if_modified_since is not None
+        and ultima_mod <= request.if_modified_since
+    )
+    if nao_mudou:
+        resposta = Response(status=304)
+    else:
+        nome = 'Planner'
+        if registro.turma_id:
+            turma = db.session.get(Turma, registro.turma_id)
+            nome = f'Planner - {turma.nome}' if turma else nome
+        resposta = Response(
+            stream_with_context(tenants.iterar_com_tenant(
+                registro.user_id, gerar_ics(registro.user_id, registro.turma_id, nome))),
+            mimetype='text/calendar'
+        )
+        resposta.headers['Content-Disposition'] = 'inline; filename="planner.ics"'
 
-    for t in dados.get('turmas', []):
-        existente = Turma.query.filter_by(user_id=user_id, nome=t.get('nome')).first()
-        if existente:
-            mapa_ids_turma[t.get('id')] = existente.id
-        else:
-            codigo = t.get('codigo_completo')
-            uc = t.get('unidade_curricular')
-            if not codigo and 'descricao' in t:
-                parts = t['descricao'].split('\n')
-                for p in parts:
-                    if "Turma:" in p: codigo = p.replace("Turma:", "").strip()
-                    if "Unidade Curricular:" in p: uc = p.replace("Unidade Curricular:", "").strip()
-
-            nova = Turma(
-                user_id=user_id,
-                nome=t.get('nome'),
-                codigo_completo=codigo,
-                unidade_curricular=uc,
-                link_diario=t.get('link_diario', ''),
-                ativa=t.get('ativa', True)
-            )
-            db.session.add(nova)
-            db.session.commit()
-            mapa_ids_turma[t.get('id')] = nova.id
+    resposta.set_etag(etag)
+    if ultima_mod:
+        resposta.last_modified = ultima_mod
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
 
-    for a in dados.get('aulas', []):
-        turma_id_novo = mapa_ids_turma.get(a.get('turmaId')) or mapa_ids_turma.get(a.get('turma_id'))
-        if turma_id_novo:
-            data_str = a.get('data')
-            if isinstance(data_str, str):
-                data_dt = datetime.strptime(data_str[:10], '%Y-%m-%d').date()
-            else:
-                data_dt = data_str 
-
-            exists = Aula.query.filter_by(turma_id=turma_id_novo, data=data_dt, titulo=a.get('titulo')).first()
-            if not exists:
-                nova_aula = Aula(
-                    turma_id=turma_id_novo,
-                    professor_id=user_id,
-                    titulo=a.get('titulo'),
-                    data=data_dt,
-                    turno=a.get('turno', 'Noite'),
-                    status=a.get('status', 'Planejando'),
-                    sala=a.get('sala'),
-                    unidade_predio=a.get('unidade_predio'), # MENTORIA: Mapeado
-                    bloco_estudo=a.get('blocoEstudo') or a.get('bloco_estudo'),
-                    numero_aula=a.get('numero_aula'), # MENTORIA: Mapeado
-                    observacoes=a.get('observacoes'), # MENTORIA: Mapeado
-                    descricao=a.get('descricao'),
-                    link_arquivos=a.get('linkDrive') or a.get('link_arquivos')
-                )
-                db.session.add(nova_aula)
-    db.session.commit()
+# ==========================================
+# API DE SINCRONIZAÇÃO INCREMENTAL
+# ==========================================
+@app.route('/api/changes')
+@login_required
+@somente_leitura
+def api_alteracoes():
+    """
+    Feed de alterações do usuário a partir de um cursor: o cliente guarda o "cursor"
+    devolvido e chama de novo com ?since=<cursor>. Com "recarregar": true, o cursor
+    é antigo demais e a página deve ser recarregada inteira.
+    """
+    since = request.args.get('since', type=int)
+    return jsonify(alteracoes_desde(current_user.id, since))
+
+def processar_importacao(dados, user_id):
+    """
+    Importa turmas/aulas de um backup já carregado (dict). Aulas de backup são sempre
+    restauradas; conflitos de sala/ministrante são apenas reportados (lista de mensagens).
+    """
+    return importar_registros(registros_do_dicionario(dados), user_id)
+
+# MENTORIA: Criamos as tabelas na importação do módulo (e não só no __main__),
+# assim o gunicorn também ganha as tabelas novas sem passo manual.
+with app.app_context():
+    replica.preparar_primario(db.engine)
+    if tenants.modo_ativo():
+        # Turmas/aulas ficam nos arquivos de cada tenant (criados sob demanda);
+        # aqui só as tabelas do diretório
+        tabelas = tenants.tabelas_diretorio(db.metadata)
+        db.metadata.create_all(db.engine, tables=tabelas)
+        criar_colunas_faltantes(db.engine, tabelas)
+        criar_indices_faltantes(db.engine, tabelas)
+    else:
+        db.create_all()
+        criar_colunas_faltantes(db.engine)
+        criar_autoincremento_aula(db.engine)
+        criar_indices_faltantes(db.engine)
+        # Bancos antigos: preenche o resumo na primeira subida após a atualização
+        sem_resumo = not db.session.query(ResumoTurma.turma_id).first() and db.session.query(Turma.id).first()
+        # Turmas desativadas antes do arquivo ainda têm as aulas na tabela aula, mas o
+        # resumo delas conta só a aula_arquivada: move antes de calcular
+        arquivar_inativas()
+        if sem_resumo:
+            reconstruir_resumos()
+
+@app.cli.command('reconstruir-resumos')
+def reconstruir_resumos_cmd():
+    """Recalcula do zero o resumo de status de todas as turmas."""
+    if not tenants.modo_ativo():
+        qtd = reconstruir_resumos()
+    else:
+        qtd = 0
+        for user_id in db.session.execute(db.select(User.id)).scalars().all():
+            with app.app_context(), tenant(user_id):
+                qtd += reconstruir_resumos(user_id)
+    print(f"Resumo reconstruído para {qtd} turma(s).")
+
+def _atualizar_resumos_vencidos_todos():
+    """Job diário: a "próxima aula" dos resumos muda com a data, mesmo sem escritas."""
+    if not tenants.modo_ativo():
+        with app.app_context():
+            return atualizar_resumos_vencidos()
+    total = 0
+    with app.app_context():
+        user_ids = db.session.execute(db.select(User.id)).scalars().all()
+    for user_id in user_ids:
+        with app.app_context(), tenant(user_id):
+            total += atualizar_resumos_vencidos(user_id)
+    return total
+
+@app.cli.command('compactar-alteracoes')
+def compactar_alteracoes_cmd():
+    """Compacta o log de alterações e apaga o que passou da retenção."""
+    print(f"{_compactar_alteracoes_todos()} alteração(ões) removida(s) do log.")
+
+def _compactar_alteracoes_todos():
+    dias = app.config['ALTERACOES_RETENCAO_DIAS']
+    if not tenants.modo_ativo():
+        with app.app_context():
+            return compactar_alteracoes(dias)
+    total = 0
+    with app.app_context():
+        user_ids = db.session.execute(db.select(User.id)).scalars().all()
+    for user_id in user_ids:
+        with app.app_context(), tenant(user_id):
+            total += compactar_alteracoes(dias, user_id)
+    return total
+
+@app.cli.command('aplicar-retencao')
+@click.option('--simular', is_flag=True, help='Só mostra o que seria apagado.')
+def aplicar_retencao_cmd(simular):
+    """Apaga do Drive os backups que a política de retenção (BACKUP_RETENCAO) descarta."""
+    total, apagar, apagados = aplicar_retencao(drive_service, app.config['BACKUP_RETENCAO'], simular=simular)
+    for arquivo in apagar:
+        print(f"   {'[SIMULADO]' if simular else '[APAGAR]'} {arquivo['name']} ({arquivo['createdTime']})")
+    print(f"{total} backup(s) listado(s), {len(apagar)} fora da política, {apagados} apagado(s).")
+
+def realizar_retencao_backups():
+    timestamp = datetime.now().strftime('%H:%M:%S')
+    try:
+        total, apagar, apagados = aplicar_retencao(drive_service, app.config['BACKUP_RETENCAO'])
+        print(f"--- [{timestamp}] JOB: Retenção de backups: {apagados}/{len(apagar)} apagado(s) de {total} ---")
+    except Exception as e:
+        # Listagem incompleta: melhor não apagar nada nesta rodada
+        print(f"--- [{timestamp}] JOB: Retenção de backups falhou: {e} ---")
+
+@app.cli.command('arquivar-inativas')
+def arquivar_inativas_cmd():
+    """Move para o arquivo as aulas das turmas que já estavam desativadas."""
+    if not tenants.modo_ativo():
+        qtd = arquivar_inativas()
+    else:
+        qtd = 0
+        for user_id in db.session.execute(db.select(User.id)).scalars().all():
+            with app.app_context(), tenant(user_id):
+                qtd += arquivar_inativas(user_id)
+    print(f"{qtd} turma(s) desativada(s) tiveram as aulas movidas para o arquivo.")
+
+@app.cli.command('migrar-para-tenants')
+def migrar_para_tenants_cmd():
+    """Copia turmas/aulas do banco único para os arquivos de cada tenant (TENANT_MODE ligado)."""
+    if not tenants.modo_ativo():
+        print("Defina TENANT_MODE (usuario ou bucket) antes de migrar.")
+        return
+    user_ids = db.session.execute(db.select(User.id)).scalars().all()
+    for user_id in user_ids:
+        copiados = tenants.migrar_usuario(db.engine, db.metadata, user_id)
+        if copiados is None:
+            print(f"   [PULADO] usuário {user_id}: tenant já tem dados")
+            continue
+        # Sessão nova por usuário: ids de tenants diferentes podem coincidir
+        with app.app_context(), tenant(user_id):
+            arquivar_inativas(user_id)
+            reconstruir_resumos(user_id)
+        print(f"   [OK] usuário {user_id} -> {tenants.chave_tenant(user_id)} ({copiados} linha(s))")
+    print("Migração concluída. As tabelas antigas continuam no banco principal até serem apagadas manualmente.")
+
+@app.cli.command('replica-fake')
+@click.option('--destino', default=None, help='Arquivo da réplica (padrão: instance/replica.db).')
+@click.option('--intervalo', default=0.0, help='Segundos entre cópias; 0 copia uma vez só.')
+def replica_fake_cmd(destino, intervalo):
+    """
+    Simula uma réplica de leitura copiando o banco SQLite principal para um segundo
+    arquivo. Com --intervalo, recopia periodicamente (o atraso entre cópias faz o
+    papel do lag de replicação, útil para testar o read-your-writes).
+    """
+    if db.engine.url.get_backend_name() != 'sqlite':
+        print("A réplica fake só funciona com DATABASE_URL em SQLite.")
+        return
+    destino = os.path.abspath(destino or os.path.join(app.instance_path, 'replica.db'))
+    print(f"Use: DATABASE_READ_URL=sqlite:///{destino}")
+    while True:
+        replica.copiar_sqlite(db.engine.url.database, destino)
+        print(f"   [{datetime.now().strftime('%H:%M:%S')}] réplica atualizada")
+        if not intervalo:
+            break
+        time.sleep(intervalo)
 
 # ==========================================
 # AGENDADOR DE TAREFAS (CORRIGIDO)
@@ -752,31 +1273,40 @@ def realizar_backup_automatico():
     print(f"--- [{timestamp}] JOB: Iniciando Backup Automático ---")
     
     with app.app_context():
-        usuarios = User.query.all()
-        for user in usuarios:
-            try:
+        user_ids = db.session.execute(db.select(User.id)).scalars().all()
+
+    # MENTORIA: Cada usuário é independente (e no modo tenant mora em outro arquivo),
+    # então os backups rodam em paralelo em vez de um atrás do outro
+    with ThreadPoolExecutor(max_workers=app.config['BACKUP_PARALELO'], thread_name_prefix='backup') as pool:
+        list(pool.map(_backup_automatico_usuario, user_ids))
+
+def _backup_automatico_usuario(user_id):
+    with app.app_context(), tenant(user_id):
+        user = db.session.get(User, user_id)
+        try:
+            with leitura():
                 data = user.to_dict()
-                json_str = json.dumps(data, indent=4, ensure_ascii=False)
-                filename = f"backup_AUTO_{user.nome}_{datetime.now().strftime('%Y-%m-%d_%Hh%M')}.json"
-                
-                success, msg = drive_service.upload_backup(filename, json_str)
-                if success:
-                    print(f"   [OK] {user.nome}")
-                else:
-                    print(f"   [ERRO] {user.nome}: {msg}")
-            except Exception as e:
-                print(f"   [CRITICAL] {user.nome}: {e}")
+            json_str = json.dumps(data, indent=4, ensure_ascii=False)
+            filename = f"backup_AUTO_{user.nome}_{datetime.now().strftime('%Y-%m-%d_%Hh%M')}.json"
+
+            success, msg = drive_service.upload_backup(filename, json_str, user_id=user_id, tipo='auto')
+            if success:
+                print(f"   [OK] {user.nome}")
+            else:
+                print(f"   [ERRO] {user.nome}: {msg}")
+        except Exception as e:
+            print(f"   [CRITICAL] {user.nome}: {e}")
 
 # MENTORIA: Lógica de inicialização do Scheduler protegida
 # Isso evita que o scheduler rode 2x quando o Flask está em modo Debug
 if __name__ == '__main__':
     scheduler = BackgroundScheduler()
     scheduler.add_job(realizar_backup_automatico, trigger="interval", minutes=60)
+    scheduler.add_job(_compactar_alteracoes_todos, trigger="interval", hours=24)
+    scheduler.add_job(realizar_retencao_backups, trigger="interval", hours=6)
+    scheduler.add_job(_atualizar_resumos_vencidos_todos, trigger="cron", hour=0, minute=5)
     scheduler.start()
     atexit.register(lambda: scheduler.shutdown())
-
-    with app.app_context():
-        db.create_all()
     
     # use_reloader=False pode ser usado se o scheduler ainda duplicar,
     # mas a proteção de __name__ costuma resolver em produção.
@@ -0,0 +1,73 @@
+from sqlalchemy import select, insert, delete
+
+from alteracoes import registrar_aulas_movidas
+from models import db, Turma, Aula, AulaArquivada
+from resumo_turmas import atualizar_resumos
+
+COLUNAS = [c.name for c in Aula.__table__.columns]
+
+
+def _mover(conn, origem, destino, turma_ids):
+    """
+    Move as aulas das turmas de uma tabela para a outra com os mesmos ids. Toda aula
+    nasce na tabela aula (AUTOINCREMENT, ids nunca reaproveitados), então o id de uma
+    aula arquivada não pode estar em uso na tabela quente e vice-versa.
+    """
+    filtro = origem.c.turma_id.in_(turma_ids)
+    conn.execute(insert(destino).from_select(COLUNAS, select(*[origem.c[n] for n in COLUNAS]).where(filtro)))
+    conn.execute(delete(origem).where(filtro))
+
+
+def sincronizar_camadas(turma_ids):
+    """
+    Coloca as aulas de cada turma na camada certa: turmas ativas na tabela aula,
+    desativadas na aula_arquivada. Chamar depois de mudar Turma.ativa (antes do commit).
+    """
+    turma_ids = {int(t) for t in turma_ids if t is not None}
+    if not turma_ids:
+        return
+    # Garante que aulas e turmas pendentes já estão no banco antes do INSERT ... SELECT
+    db.session.flush()
+
+    conn = db.session.connection(bind_arguments={'mapper': Aula, 'escrita': True})
+    turma = Turma.__table__
+    ativas = dict(conn.execute(select(turma.c.id, turma.c.ativa).where(turma.c.id.in_(turma_ids))).all())
+
+    arquivar = [t for t, ativa in ativas.items() if not ativa]
+    restaurar = [t for t, ativa in ativas.items() if ativa]
+    if arquivar:
+        registrar_aulas_movidas(conn, Aula.__table__, arquivar, 'delete')
+        _mover(conn, Aula.__table__, AulaArquivada.__table__, arquivar)
+    if restaurar:
+        _mover(conn, AulaArquivada.__table__, Aula.__table__, restaurar)
+        registrar_aulas_movidas(conn, Aula.__table__, restaurar, 'upsert')
+
+    # As linhas foram movidas por fora do ORM: descarta as instâncias carregadas
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, (Aula, AulaArquivada)) and obj.turma_id in turma_ids:
+            db.session.expunge(obj)
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Turma) and obj.id in turma_ids:
+            db.session.expire(obj, ['aulas', 'aulas_arquivadas'])
+
+    atualizar_resumos(conn, ativas.keys())
+
+
+def aulas_das_duas_camadas(turma):
+    """Aulas da turma na camada quente e no arquivo, em ordem de data."""
+    return sorted(list(turma.aulas) + list(turma.aulas_arquivadas), key=lambda a: a.data)
+
+
+def arquivar_inativas(user_id=None):
+    """
+    Move para o arquivo as aulas de todas as turmas desativadas (bancos já existentes).
+    Só olha as turmas que ainda têm aulas na tabela quente: sem nada a mover, é uma
+    consulta e nenhuma escrita (roda em toda subida do app).
+    """
+    consulta = select(Turma.id).where(Turma.ativa == False, Turma.id.in_(select(Aula.turma_id).distinct()))
+    if user_id is not None:
+        consulta = consulta.where(Turma.user_id == user_id)
+    turma_ids = db.session.execute(consulta).scalars().all()
+    sincronizar_camadas(turma_ids)
+    db.session.commit()
+    return len(turma_ids)
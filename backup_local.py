@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+
+
+class LocalBackupService:
+    """
+    Substituto do DriveService que grava os backups numa pasta local, com a mesma
+    interface. Útil em desenvolvimento, testes de carga e instalações sem Google Drive
+    (BACKUP_BACKEND=local).
+    """
+
+    def __init__(self, pasta):
+        self.pasta = os.path.abspath(pasta)
+        os.makedirs(self.pasta, exist_ok=True)
+        self.service = True  # mesmo sinal de "autenticado" usado pelo DriveService
+
+    def _caminho(self, file_id):
+        # O id é o nome do arquivo na pasta; basename impede sair da pasta
+        nome = os.path.basename(file_id or '')
+        return os.path.join(self.pasta, nome) if nome else None
+
+    def upload_backup(self, filename, json_content, user_id=None, tipo='manual'):
+        try:
+            # Como no Drive, o id é único e o nome é só rótulo: dois usuários (ou dois
+            # cliques) no mesmo minuto geram o mesmo nome e não podem se sobrescrever
+            caminho = self._caminho(f"{uuid.uuid4().hex[:12]}_{os.path.basename(filename)}")
+            temporario = caminho + '.tmp'
+            # Mesmos tipos aceitos pelo DriveService: str, bytes ou arquivo binário
+            if isinstance(json_content, str):
+                json_content = json_content.encode('utf-8')
+            with open(temporario, 'wb') as f:
+                if isinstance(json_content, bytes):
+                    f.write(json_content)
+                else:
+                    shutil.copyfileobj(json_content, f)
+            # appProperties do Drive ficam num arquivo ao lado
+            with open(caminho + '.props', 'w', encoding='utf-8') as f:
+                json.dump({'user_id': str(user_id or ''), 'tipo': tipo, 'nome': filename}, f)
+            os.replace(temporario, caminho)
+            return True, "Backup salvo com sucesso!"
+        except Exception as e:
+            return False, str(e)
+
+    def _propriedades(self, caminho):
+        try:
+            with open(caminho + '.props', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _info(self, caminho, propriedades):
+        info = os.stat(caminho)
+        propriedades = dict(propriedades)
+        return {
+            'id': os.path.basename(caminho),
+            # Backups antigos não têm o nome no .props: o id era o próprio nome
+            'name': propriedades.pop('nome', None) or os.path.basename(caminho),
+            'createdTime': datetime.fromtimestamp(info.st_mtime, timezone.utc).isoformat().replace('+00:00', 'Z'),
+            'size': str(info.st_size),
+            'appProperties': propriedades,
+        }
+
+    def _todos(self, user_id=None):
+        arquivos = []
+        for entrada in os.scandir(self.pasta):
+            if not entrada.is_file() or not entrada.name.endswith('.json'):
+                continue
+            propriedades = self._propriedades(entrada.path)
+            if user_id is not None and propriedades.get('user_id') != str(user_id):
+                continue
+            arquivos.append(self._info(entrada.path, propriedades))
+        arquivos.sort(key=lambda f: f['createdTime'], reverse=True)
+        return arquivos
+
+    def list_backups_page(self, user_id=None, cursor=None, page_size=10):
+        # O cursor é só o deslocamento na lista ordenada
+        inicio = int(cursor or 0)
+        arquivos = self._todos(user_id)
+        fim = inicio + page_size
+        return arquivos[inicio:fim], (str(fim) if fim < len(arquivos) else None)
+
+    def list_backups(self, user_id=None):
+        return self.list_backups_page(user_id)[0]
+
+    def iter_backups(self, user_id=None):
+        yield from self._todos(user_id)
+
+    def metadados(self, file_id):
+        caminho = self._caminho(file_id)
+        if not caminho or not os.path.isfile(caminho):
+            return None
+        return self._info(caminho, self._propriedades(caminho))
+
+    def delete_backups(self, file_ids):
+        apagados = 0
+        for file_id in file_ids:
+            caminho = self._caminho(file_id)
+            if not caminho or not os.path.isfile(caminho):
+                continue
+            os.remove(caminho)
+            if os.path.exists(caminho + '.props'):
+                os.remove(caminho + '.props')
+            apagados += 1
+        return apagados
+
+    def download_file_content(self, file_id):
+        caminho = self._caminho(file_id)
+        if not caminho or not os.path.isfile(caminho):
+            return None
+        with open(caminho, encoding='utf-8') as f:
+            return f.read()
+
+    def ler_inicio(self, file_id, tamanho=64 * 1024):
+        caminho = self._caminho(file_id)
+        if not caminho or not os.path.isfile(caminho):
+            return None
+        with open(caminho, 'rb') as f:
+            return f.read(tamanho)
+
+    def open_download_stream(self, file_id):
+        caminho = self._caminho(file_id)
+        if not caminho or not os.path.isfile(caminho):
+            return None
+        return open(caminho, 'rb')
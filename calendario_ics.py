@@ -0,0 +1,99 @@
+from datetime import datetime, time, timezone
+
+from sqlalchemy import select, union_all
+
+from models import db, Turma, Aula, AulaArquivada
+
+# Horário aproximado de cada turno, usado para posicionar o evento na agenda
+HORARIOS_TURNO = {
+    'Manhã': (time(8, 0), time(12, 0)),
+    'Tarde': (time(13, 30), time(17, 30)),
+    'Noite': (time(19, 0), time(22, 30)),
+}
+
+# Quantas linhas o cursor do servidor entrega por vez
+LINHAS_POR_LOTE = 500
+
+
+def _escapar(texto):
+    return (str(texto or '')
+            .replace('\\', '\\\\')
+            .replace(';', '\\;')
+            .replace(',', '\\,')
+            .replace('\r\n', '\\n')
+            .replace('\n', '\\n'))
+
+
+def _dobrar(linha):
+    """Quebra linhas com mais de 75 octetos, como pede a RFC 5545."""
+    dados = linha.encode('utf-8')
+    if len(dados) <= 75:
+        return linha + '\r\n'
+    partes = []
+    atual = ''
+    limite = 75
+    for ch in linha:
+        if len((atual + ch).encode('utf-8')) > limite:
+            partes.append(atual)
+            atual = ''
+            limite = 74  # as continuações começam com um espaço
+        atual += ch
+    partes.append(atual)
+    return '\r\n '.join(partes) + '\r\n'
+
+
+def gerar_ics(user_id, turma_id=None, nome_calendario='Planner'):
+    """
+    Gera o calendário linha a linha. As aulas vêm de um cursor do servidor em
+    ordem de data, então a memória não cresce com o tamanho do histórico.
+    O feed de uma turma também traz as aulas do arquivo (turma desativada);
+    o feed geral só tem turmas ativas, que ficam todas na tabela aula.
+    """
+    def _consulta(modelo):
+        return (
+            select(modelo.id, modelo.data, modelo.turno, modelo.titulo, modelo.status,
+                   modelo.sala, modelo.unidade_predio, modelo.descricao, Turma.nome)
+            .join(Turma, modelo.turma_id == Turma.id)
+            .where(Turma.user_id == user_id)
+        )
+
+    if turma_id is not None:
+        partes = union_all(*(_consulta(m).where(Turma.id == turma_id) for m in (Aula, AulaArquivada))).subquery()
+        consulta = select(partes).order_by(partes.c.data.asc(), partes.c.id.asc())
+    else:
+        consulta = _consulta(Aula).where(Turma.ativa == True).order_by(Aula.data.asc(), Aula.id.asc())
+
+    # DTSTAMP é sempre em UTC (RFC 5545)
+    carimbo = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    yield ''.join(_dobrar(l) for l in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Planner//Aulas//PT-BR',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_escapar(nome_calendario)}',
+    ))
+
+    resultado = db.session.execute(consulta.execution_options(yield_per=LINHAS_POR_LOTE))
+    for aula_id, data, turno, titulo, status, sala, unidade, descricao, turma_nome in resultado:
+        inicio, fim = HORARIOS_TURNO.get(turno, HORARIOS_TURNO['Noite'])
+        local = ' - '.join(p for p in (unidade, f'Sala {sala}' if sala else None) if p)
+
+        linhas = [
+            'BEGIN:VEVENT',
+            f'UID:aula-{aula_id}@planner',
+            f'DTSTAMP:{carimbo}',
+            f"DTSTART:{datetime.combine(data, inicio).strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND:{datetime.combine(data, fim).strftime('%Y%m%dT%H%M%S')}",
+            f'SUMMARY:{_escapar(f"{turma_nome}: {titulo}")}',
+        ]
+        if local:
+            linhas.append(f'LOCATION:{_escapar(local)}')
+        if descricao:
+            linhas.append(f'DESCRIPTION:{_escapar(descricao)}')
+        linhas.append(f'CATEGORIES:{_escapar(status)}')
+        linhas.append('END:VEVENT')
+        # Um pedaço da resposta por evento
+        yield ''.join(_dobrar(l) for l in linhas)
+
+    yield _dobrar('END:VCALENDAR')
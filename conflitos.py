@@ -0,0 +1,81 @@
+from sqlalchemy import or_, select
+
+from models import db, Turma, Aula
+
+# Limite de datas por consulta (fica bem abaixo do limite de parâmetros do SQLite)
+DATAS_POR_CONSULTA = 500
+
+
+def _chave_sala(item):
+    sala = (item.get('sala') or '').strip().lower()
+    if not sala:
+        return None
+    unidade = (item.get('unidade_predio') or '').strip().lower()
+    return (item['data'], item['turno'], sala, unidade)
+
+
+def _chave_ministrante(item):
+    ministrante_id = item.get('ministrante_id')
+    if not ministrante_id:
+        return None
+    return (item['data'], item['turno'], int(ministrante_id))
+
+
+def detectar_conflitos(user_id, candidatos, ignorar_ids=()):
+    """
+    Verifica, de uma vez, se as aulas candidatas ocupam a mesma sala (sala + unidade_predio)
+    ou o mesmo ministrante no mesmo data + turno de outra aula do usuário, ou de outra
+    candidata do mesmo lote. `candidatos` é uma lista de dicts com data, turno, sala,
+    unidade_predio e ministrante_id. Retorna {indice_do_candidato: [mensagens]}.
+    """
+    conflitos = {}
+    if not candidatos:
+        return conflitos
+
+    # Uma única consulta por lote de datas: tudo o que o usuário já tem nesses dias
+    ocupados_sala = {}
+    ocupados_ministrante = {}
+    datas = sorted({c['data'] for c in candidatos})
+    for i in range(0, len(datas), DATAS_POR_CONSULTA):
+        consulta = (
+            select(Aula.id, Aula.data, Aula.turno, Aula.sala, Aula.unidade_predio,
+                   Aula.ministrante_id, Aula.titulo, Turma.nome)
+            .join(Turma, Aula.turma_id == Turma.id)
+            .where(
+                Turma.user_id == user_id,
+                Aula.data.in_(datas[i:i + DATAS_POR_CONSULTA]),
+                or_(Aula.sala.isnot(None), Aula.ministrante_id.isnot(None))
+            )
+        )
+        for aula_id, data, turno, sala, unidade, ministrante_id, titulo, turma_nome in db.session.execute(consulta):
+            if aula_id in ignorar_ids:
+                continue
+            existente = {'data': data, 'turno': turno, 'sala': sala,
+                         'unidade_predio': unidade, 'ministrante_id': ministrante_id}
+            descricao = f'"{titulo}" ({turma_nome})'
+            chave = _chave_sala(existente)
+            if chave:
+                ocupados_sala.setdefault(chave, descricao)
+            chave = _chave_ministrante(existente)
+            if chave:
+                ocupados_ministrante.setdefault(chave, descricao)
+
+    for idx, candidato in enumerate(candidatos):
+        quando = f"{candidato['data'].strftime('%d/%m/%Y')} ({candidato['turno']})"
+        chave = _chave_sala(candidato)
+        if chave:
+            if chave in ocupados_sala:
+                conflitos.setdefault(idx, []).append(
+                    f"sala {candidato['sala'].strip()} já ocupada em {quando} por {ocupados_sala[chave]}")
+            else:
+                ocupados_sala[chave] = f"\"{candidato.get('titulo')}\" (mesmo lote)"
+
+        chave = _chave_ministrante(candidato)
+        if chave:
+            if chave in ocupados_ministrante:
+                conflitos.setdefault(idx, []).append(
+                    f"ministrante já alocado em {quando} para {ocupados_ministrante[chave]}")
+            else:
+                ocupados_ministrante[chave] = f"\"{candidato.get('titulo')}\" (mesmo lote)"
+
+    return conflitos
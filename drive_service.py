@@ -1,9 +1,15 @@
 import os.path
 import io
+import hashlib
+import tempfile
+import threading
+import time
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 
 # Se alterar estes escopos, apague o arquivo token.json
@@ -11,10 +17,69 @@ SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
 FOLDER_NAME = "Planner_Backups"
 
+# Tamanho de cada pedaço enviado/baixado; o upload resumable exige múltiplos de 256 KiB
+CHUNK_SIZE = 4 * 1024 * 1024
+CHUNK_MINIMO = 256 * 1024
+# Downloads ficam em memória até este tamanho; acima disso vão para um arquivo temporário
+SPOOL_MAX = 8 * 1024 * 1024
+# Tentativas por pedaço (com backoff, feitas pelo próprio cliente) e retomadas seguidas
+# a partir do último byte confirmado quando elas se esgotam
+TENTATIVAS = 5
+RETOMADAS = 3
+# Erros HTTP que valem nova tentativa
+STATUS_TRANSITORIOS = {408, 429, 500, 502, 503, 504}
+
+# Limites da API: 1000 arquivos por página de listagem, 100 chamadas por batch
+MAX_PAGE_SIZE = 1000
+MAX_BATCH = 100
+
+
+class ErroIntegridade(Exception):
+    """O checksum do arquivo transferido não confere com o md5Checksum do Drive."""
+
+
+class _ArquivoComHash(io.RawIOBase):
+    """Repassa as escritas para `destino` calculando MD5 e SHA-256 no caminho."""
+
+    def __init__(self, destino):
+        self.destino = destino
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.md5.update(dados)
+        self.sha256.update(dados)
+        return self.destino.write(dados)
+
+
+def _transitorio(erro):
+    if isinstance(erro, HttpError):
+        return erro.resp.status in STATUS_TRANSITORIOS
+    return isinstance(erro, (httplib2.HttpLib2Error, OSError))
+
+
+def _conferir(md5, sha256, metadados):
+    """Compara os hashes locais com os do Drive (o sha256Checksum nem sempre vem)."""
+    if metadados.get('md5Checksum') and metadados['md5Checksum'] != md5.hexdigest():
+        raise ErroIntegridade(f"MD5 não confere ({md5.hexdigest()} != {metadados['md5Checksum']})")
+    if metadados.get('sha256Checksum') and metadados['sha256Checksum'] != sha256.hexdigest():
+        raise ErroIntegridade("SHA-256 não confere")
+
+
 class DriveService:
-    def __init__(self):
+    def __init__(self, chunk_size=CHUNK_SIZE, spool_max=SPOOL_MAX, tentativas=TENTATIVAS, retomadas=RETOMADAS):
         self.creds = None
         self.service = None
+        self.chunk_size = max(CHUNK_MINIMO, chunk_size // CHUNK_MINIMO * CHUNK_MINIMO)
+        self.spool_max = spool_max
+        self.tentativas = tentativas
+        self.retomadas = retomadas
+        # MENTORIA: o cliente HTTP do Drive (httplib2) não é thread-safe; como as
+        # chamadas agora rodam num pool de threads, cada thread ganha o seu cliente.
+        self._local = threading.local()
         self._authenticate()
 
     def _authenticate(self):
@@ -58,6 +123,41 @@ class DriveService:
         except Exception as e:
             print(f"Erro ao conectar serviço Drive: {e}")
 
+    def _cliente(self):
+        """Retorna o cliente exclusivo da thread atual."""
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            if threading.current_thread() is threading.main_thread():
+                service = self.service
+            else:
+                service = build('drive', 'v3', credentials=self.creds)
+            self._local.service = service
+        return service
+
+    def _files(self):
+        """Retorna o recurso files() do cliente exclusivo da thread atual."""
+        return self._cliente().files()
+
+    def _transferir(self, passo):
+        """
+        Chama `passo()` (um next_chunk) até ele devolver algo diferente de None. Se as
+        tentativas de um pedaço se esgotarem num erro transitório, espera e retoma do
+        último byte que o Drive confirmou (o MediaIoBase* guarda essa posição).
+        """
+        falhas = 0
+        while True:
+            try:
+                resultado = passo()
+                falhas = 0
+            except Exception as e:
+                if not _transitorio(e) or falhas >= self.retomadas:
+                    raise
+                falhas += 1
+                time.sleep(2 ** falhas)
+                continue
+            if resultado is not None:
+                return resultado
+
     def _get_or_create_folder(self):
         """Encontra ou cria a pasta usando a conta do próprio usuário."""
         if not self.service: return None
@@ -65,7 +165,7 @@ class DriveService:
         try:
             # Busca a pasta pelo nome
             query = f"mimeType='application/vnd.google-apps.folder' and name='{FOLDER_NAME}' and trashed=false"
-            results = self.service.files().list(q=query, fields="files(id)").execute()
+            results = self._files().list(q=query, fields="files(id)").execute()
             files = results.get('files', [])
 
             if files:
@@ -76,13 +176,18 @@ class DriveService:
                     'name': FOLDER_NAME,
                     'mimeType': 'application/vnd.google-apps.folder'
                 }
-                folder = self.service.files().create(body=file_metadata, fields='id').execute()
+                folder = self._files().create(body=file_metadata, fields='id').execute()
                 return folder.get('id')
         except Exception as e:
             print(f"Erro pasta: {e}")
             return None
 
-    def upload_backup(self, filename, json_content):
+    def upload_backup(self, filename, json_content, user_id=None, tipo='manual'):
+        """
+        Envia em pedaços de `chunk_size` (upload resumable). `json_content` pode ser
+        str, bytes ou um arquivo binário aberto. No fim, confere o MD5 com o do Drive
+        e apaga o arquivo enviado se não bater.
+        """
         if not self.service: return False, "Serviço não autenticado"
 
         try:
@@ -91,44 +196,134 @@ class DriveService:
 
             file_metadata = {
                 'name': filename,
-                'parents': [folder_id]
+                'parents': [folder_id],
+                # Identifica o dono e a origem sem depender do nome do arquivo
+                'appProperties': {'user_id': str(user_id or ''), 'tipo': tipo}
             }
             
-            fh = io.BytesIO(json_content.encode('utf-8'))
-            media = MediaIoBaseUpload(fh, mimetype='application/json', resumable=True)
-            
-            self.service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+            if isinstance(json_content, str):
+                json_content = json_content.encode('utf-8')
+            fh = io.BytesIO(json_content) if isinstance(json_content, bytes) else json_content
+
+            # Hash do que vai ser enviado, lendo o arquivo em pedaços
+            md5, sha256 = hashlib.md5(), hashlib.sha256()
+            fh.seek(0)
+            for pedaco in iter(lambda: fh.read(self.chunk_size), b''):
+                md5.update(pedaco)
+                sha256.update(pedaco)
+            fh.seek(0)
+
+            media = MediaIoBaseUpload(fh, mimetype='application/json', chunksize=self.chunk_size, resumable=True)
+            request = self._files().create(
+                body=file_metadata, media_body=media, fields='id, md5Checksum, sha256Checksum, size'
+            )
+            enviado = self._transferir(lambda: request.next_chunk(num_retries=self.tentativas)[1])
+
+            try:
+                _conferir(md5, sha256, enviado)
+            except ErroIntegridade:
+                self._files().delete(fileId=enviado['id']).execute()
+                raise
             return True, "Backup salvo com sucesso!"
         except Exception as e:
             return False, str(e)
 
-    def list_backups(self):
-        if not self.service: return []
+    def _listar(self, user_id=None, cursor=None, page_size=10):
+        folder_id = self._get_or_create_folder()
+        if not folder_id:
+            raise RuntimeError("Erro ao acessar pasta")
+
+        query = f"'{folder_id}' in parents and mimeType='application/json' and trashed=false"
+        if user_id is not None:
+            query += f" and appProperties has {{ key='user_id' and value='{int(user_id)}' }}"
+        results = self._files().list(
+            q=query, 
+            pageSize=min(page_size, MAX_PAGE_SIZE), 
+            pageToken=cursor,
+            orderBy="createdTime desc", 
+            fields="nextPageToken, files(id, name, createdTime, size, appProperties)"
+        ).execute()
+        return results.get('files', []), results.get('nextPageToken')
+
+    def list_backups_page(self, user_id=None, cursor=None, page_size=10):
+        """Uma página da listagem (mais novos primeiro). Retorna (arquivos, próximo_cursor)."""
+        if not self.service: return [], None
         try:
-            folder_id = self._get_or_create_folder()
-            if not folder_id: return []
-
-            query = f"'{folder_id}' in parents and mimeType='application/json' and trashed=false"
-            results = self.service.files().list(
-                q=query, 
-                pageSize=10, 
-                orderBy="createdTime desc", 
-                fields="files(id, name, createdTime, size)"
-            ).execute()
-            return results.get('files', [])
+            return self._listar(user_id, cursor, page_size)
         except Exception as e:
             print(f"Erro listar: {e}")
-            return []
+            return [], None
+
+    def list_backups(self, user_id=None):
+        return self.list_backups_page(user_id)[0]
+
+    def iter_backups(self, user_id=None):
+        """Percorre todas as páginas. Erros são propagados (a retenção não pode agir sobre lista parcial)."""
+        if not self.service: return
+        cursor = None
+        while True:
+            arquivos, cursor = self._listar(user_id, cursor, MAX_PAGE_SIZE)
+            yield from arquivos
+            if not cursor:
+                break
+
+    def metadados(self, file_id):
+        """Nome, data e appProperties do arquivo, sem baixar o conteúdo."""
+        if not self.service: return None
+        return self._files().get(fileId=file_id, fields='id, name, createdTime, size, appProperties').execute()
+
+    def delete_backups(self, file_ids):
+        """Apaga os arquivos em batches de até 100 chamadas. Retorna quantos foram apagados."""
+        if not self.service or not file_ids: return 0
+        cliente = self._cliente()
+        apagados = []
+
+        def _callback(request_id, response, exception):
+            if exception is None:
+                apagados.append(request_id)
+            else:
+                print(f"Erro ao apagar backup: {exception}")
+
+        for i in range(0, len(file_ids), MAX_BATCH):
+            batch = cliente.new_batch_http_request(callback=_callback)
+            for file_id in file_ids[i:i + MAX_BATCH]:
+                batch.add(cliente.files().delete(fileId=file_id))
+            batch.execute()
+        return len(apagados)
 
     def download_file_content(self, file_id):
         if not self.service: return None
         try:
-            request = self.service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            return fh.getvalue().decode('utf-8')
+            with self.open_download_stream(file_id) as arquivo:
+                return arquivo.read().decode('utf-8')
         except Exception as e:
             return None
+
+    def ler_inicio(self, file_id, tamanho=64 * 1024):
+        """Só os primeiros `tamanho` bytes do arquivo (um GET com Range), sem checksum."""
+        if not self.service: return None
+        request = self._files().get_media(fileId=file_id)
+        request.headers['Range'] = f'bytes=0-{tamanho - 1}'
+        return request.execute()
+
+    def open_download_stream(self, file_id):
+        """
+        Baixa o arquivo em pedaços para um arquivo temporário (em memória até
+        `spool_max`, em disco acima disso), retomando do último byte recebido se a
+        conexão cair, e confere o checksum antes de devolver: nada é importado de
+        um download incompleto. Retorna o arquivo binário aberto no início.
+        """
+        if not self.service: return None
+        metadados = self._files().get(fileId=file_id, fields='md5Checksum, sha256Checksum, size').execute()
+
+        destino = tempfile.SpooledTemporaryFile(max_size=self.spool_max)
+        try:
+            hasheador = _ArquivoComHash(destino)
+            downloader = MediaIoBaseDownload(hasheador, self._files().get_media(fileId=file_id), chunksize=self.chunk_size)
+            self._transferir(lambda: downloader.next_chunk(num_retries=self.tentativas)[1] or None)
+            _conferir(hasheador.md5, hasheador.sha256, metadados)
+        except Exception:
+            destino.close()
+            raise
+        destino.seek(0)
+        return destino
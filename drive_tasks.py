@@ -0,0 +1,96 @@
+import json
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models import db, OperacaoDrive
+from tenants import chave_atual, usar_chave
+
+# Operações concluídas há mais tempo que isso são apagadas da tabela
+RETENCAO_OPERACOES = timedelta(days=1)
+
+
+class DriveTaskRunner:
+    """
+    Executa as chamadas ao Google Drive num pool de threads próprio, para que
+    as threads HTTP do gunicorn fiquem livres enquanto o upload/download acontece.
+    Cada chamada vira uma OperacaoDrive, consultada depois pelo id.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._vagas = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        max_workers = int(app.config.get('DRIVE_MAX_WORKERS', 2))
+        max_pendentes = int(app.config.get('DRIVE_MAX_PENDENTES', 20))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='drive')
+        # Limita a fila: sem isso um pico de cliques acumularia tarefas sem fim
+        self._vagas = threading.BoundedSemaphore(max_pendentes)
+
+    def submeter(self, user_id, tipo, funcao, *args, **kwargs):
+        """
+        Agenda `funcao(*args, **kwargs)` e retorna o id da operação, ou None se
+        a fila estiver cheia. A função deve retornar (sucesso, mensagem, resultado).
+        """
+        if not self._vagas.acquire(blocking=False):
+            return None
+
+        try:
+            self._limpar_antigas()
+            op = OperacaoDrive(id=uuid.uuid4().hex, user_id=user_id, tipo=tipo, status='pendente')
+            db.session.add(op)
+            db.session.commit()
+            op_id = op.id
+            # A thread do pool leva junto o tenant da requisição (TENANT_MODE)
+            self._executor.submit(self._executar, op_id, chave_atual(), funcao, args, kwargs)
+        except Exception:
+            db.session.rollback()
+            self._vagas.release()
+            raise
+        return op_id
+
+    def status(self, op_id, user_id):
+        op = db.session.get(OperacaoDrive, op_id)
+        if not op or op.user_id != user_id:
+            return None
+        return op.to_dict()
+
+    def _executar(self, op_id, chave_tenant, funcao, args, kwargs):
+        try:
+            with self.app.app_context(), usar_chave(chave_tenant):
+                self._atualizar(op_id, status='executando')
+                try:
+                    sucesso, mensagem, resultado = funcao(*args, **kwargs)
+                except Exception as e:
+                    db.session.rollback()
+                    sucesso, mensagem, resultado = False, str(e), None
+
+                self._atualizar(
+                    op_id,
+                    status='concluida' if sucesso else 'erro',
+                    mensagem=(mensagem or '')[:300],
+                    resultado=json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                    concluido_em=datetime.now()
+                )
+        except Exception as e:
+            print(f"Erro na operação do Drive {op_id}: {e}")
+        finally:
+            self._vagas.release()
+
+    def _atualizar(self, op_id, **campos):
+        op = db.session.get(OperacaoDrive, op_id)
+        if not op:
+            return
+        for campo, valor in campos.items():
+            setattr(op, campo, valor)
+        db.session.commit()
+
+    def _limpar_antigas(self):
+        limite = datetime.now() - RETENCAO_OPERACOES
+        OperacaoDrive.query.filter(OperacaoDrive.criado_em < limite).delete(synchronize_session=False)
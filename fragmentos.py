@@ -0,0 +1,61 @@
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from tenants import chave_atual
+
+_cache = OrderedDict()
+_trava = threading.Lock()
+_config = {'max': 5000}
+
+
+def configurar(app):
+    """
+    Liga o cache de bytecode do Jinja (compartilhado em disco pelos workers do
+    gunicorn: só o primeiro a subir compila os templates) e o de fragmentos.
+    """
+    pasta = app.config.get('JINJA_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(pasta, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(pasta)
+
+    _config['max'] = app.config.get('FRAGMENTOS_MAX', 5000)
+    app.jinja_env.globals.update(fragmento=fragmento, card_aula=card_aula)
+
+
+def fragmento(template, chave, **contexto):
+    """
+    Renderiza `template` com `contexto` e guarda o HTML; enquanto a `chave` for a
+    mesma, devolve o que já foi renderizado. A chave precisa cobrir tudo o que o
+    template usa. FRAGMENTOS_MAX=0 desliga o cache.
+    """
+    if not _config['max']:
+        return Markup(current_app.jinja_env.get_template(template).render(**contexto))
+
+    # Ids de tenants diferentes podem coincidir
+    chave = (template, chave_atual(), chave)
+    with _trava:
+        html = _cache.get(chave)
+        if html is not None:
+            _cache.move_to_end(chave)
+            return html
+
+    html = Markup(current_app.jinja_env.get_template(template).render(**contexto))
+    with _trava:
+        _cache[chave] = html
+        while len(_cache) > _config['max']:
+            _cache.popitem(last=False)
+    return html
+
+
+def card_aula(aula, template='components/card_aula.html'):
+    # A versão da linha muda a cada UPDATE da aula; o nome da turma também aparece no card
+    return fragmento(template, (aula.id, aula.versao, aula.turma.nome), aula=aula)
+
+
+def limpar():
+    with _trava:
+        _cache.clear()
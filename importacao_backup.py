@@ -0,0 +1,267 @@
+import gzip
+import io
+import zlib
+from datetime import datetime
+
+import ijson
+
+from models import db, Turma, Aula, AulaArquivada
+from conflitos import detectar_conflitos
+from arquivo_turmas import sincronizar_camadas
+
+# Quantas aulas são inseridas por vez durante a restauração
+AULAS_POR_LOTE = 500
+# Limite de mensagens de conflito devolvidas (o total é sempre contado)
+MAX_MENSAGENS_CONFLITO = 200
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class BackupDeOutroUsuario(Exception):
+    """O backup lido pertence a outro email."""
+
+
+def abrir_backup(arquivo):
+    """Recebe um arquivo binário e descompacta na hora se for gzip."""
+    if not hasattr(arquivo, 'peek'):
+        arquivo = io.BufferedReader(arquivo)
+    if arquivo.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=arquivo, mode='rb')
+    return arquivo
+
+
+def email_no_inicio(inicio):
+    """
+    Email de um backup a partir só dos primeiros bytes (ele vem antes das turmas).
+    None se não der para saber só com esse pedaço.
+    """
+    try:
+        if inicio[:2] == GZIP_MAGIC:
+            # GzipFile recusa um fluxo cortado; o decompressobj devolve o que já deu
+            inicio = zlib.decompressobj(wbits=31).decompress(inicio)
+        for registro in ler_backup(io.BytesIO(inicio)):
+            return registro[1] if registro[0] == 'email' else None
+    except (ijson.JSONError, EOFError, OSError, zlib.error):
+        return None
+    return None
+
+
+def ler_backup(arquivo):
+    """
+    Lê o JSON do backup de forma incremental, sem carregar o arquivo todo.
+    Gera tuplas ('email', valor), ('turma', indice, campos) e ('aula', indice_turma, campos).
+
+    Aceita o formato atual (aulas dentro de cada turma) e o antigo (lista "aulas"
+    no topo, ligada às turmas por turmaId/turma_id; nesse caso indice_turma é None).
+    """
+    turma = None
+    turma_emitida = False
+    indice_turma = -1
+    construtor = None
+    prefixo_aula = None
+
+    for prefixo, evento, valor in ijson.parse(abrir_backup(arquivo), use_float=True):
+        if construtor is not None:
+            construtor.event(evento, valor)
+            if prefixo == prefixo_aula and evento == 'end_map':
+                yield ('aula', indice_turma if prefixo_aula.startswith('turmas.') else None, construtor.value)
+                construtor = None
+            continue
+
+        if prefixo == 'email' and evento == 'string':
+            yield ('email', valor)
+
+        elif prefixo == 'turmas.item' and evento == 'start_map':
+            turma, turma_emitida = {}, False
+            indice_turma += 1
+        elif prefixo == 'turmas.item' and evento == 'end_map':
+            if not turma_emitida:
+                yield ('turma', indice_turma, turma)
+            turma = None
+        elif turma is not None and prefixo.count('.') == 2 and evento in ('string', 'number', 'boolean', 'null'):
+            turma[prefixo.rsplit('.', 1)[1]] = valor
+        elif prefixo == 'turmas.item.aulas' and evento == 'start_array':
+            # No formato atual as aulas vêm depois dos campos da turma
+            yield ('turma', indice_turma, turma)
+            turma_emitida = True
+
+        elif prefixo in ('turmas.item.aulas.item', 'aulas.item') and evento == 'start_map':
+            construtor = ijson.ObjectBuilder()
+            construtor.event(evento, valor)
+            prefixo_aula = prefixo
+
+
+def registros_do_dicionario(dados):
+    """Converte um backup já carregado (dict) nos mesmos registros de ler_backup."""
+    if dados.get('email') is not None:
+        yield ('email', dados['email'])
+    for indice, t in enumerate(dados.get('turmas', [])):
+        yield ('turma', indice, {k: v for k, v in t.items() if k != 'aulas'})
+        for a in t.get('aulas', []) or []:
+            yield ('aula', indice, a)
+    for a in dados.get('aulas', []):
+        yield ('aula', None, a)
+
+
+def _obter_turma(t, user_id):
+    existente = Turma.query.filter_by(user_id=user_id, nome=t.get('nome')).first()
+    if existente:
+        return existente.id
+
+    codigo = t.get('codigo_completo')
+    uc = t.get('unidade_curricular')
+    if not codigo and 'descricao' in t:
+        parts = (t['descricao'] or '').split('\n')
+        for p in parts:
+            if "Turma:" in p: codigo = p.replace("Turma:", "").strip()
+            if "Unidade Curricular:" in p: uc = p.replace("Unidade Curricular:", "").strip()
+
+    nova = Turma(
+        user_id=user_id,
+        nome=t.get('nome'),
+        codigo_completo=codigo,
+        unidade_curricular=uc,
+        link_diario=t.get('link_diario', ''),
+        ativa=t.get('ativa', True)
+    )
+    db.session.add(nova)
+    db.session.flush()
+    return nova.id
+
+
+def chave_aula(aula):
+    """Mesma turma, data, turno e título = mesma aula (importação de CSV e restauração de backup)."""
+    return aula.turma_id, aula.data, aula.turno, aula.titulo
+
+
+def chaves_existentes(aulas):
+    """Chaves das aulas já gravadas (nas duas camadas) com a mesma turma e data de alguma de `aulas`."""
+    existentes = set()
+    turma_ids = {a.turma_id for a in aulas}
+    datas = sorted({a.data for a in aulas})
+    for modelo in (Aula, AulaArquivada):
+        for i in range(0, len(datas), AULAS_POR_LOTE):
+            existentes.update(db.session.query(modelo.turma_id, modelo.data, modelo.turno, modelo.titulo).filter(
+                modelo.turma_id.in_(turma_ids),
+                modelo.data.in_(datas[i:i + AULAS_POR_LOTE])
+            ).all())
+    return existentes
+
+
+def _nova_aula(a, turma_id, user_id):
+    data_str = a.get('data')
+    if isinstance(data_str, str):
+        data_dt = datetime.strptime(data_str[:10], '%Y-%m-%d').date()
+    else:
+        data_dt = data_str
+
+    return Aula(
+        turma_id=turma_id,
+        professor_id=user_id,
+        titulo=a.get('titulo'),
+        data=data_dt,
+        turno=a.get('turno', 'Noite'),
+        status=a.get('status', 'Planejando'),
+        sala=a.get('sala'),
+        unidade_predio=a.get('unidade_predio'),
+        bloco_estudo=a.get('blocoEstudo') or a.get('bloco_estudo'),
+        numero_aula=a.get('numero_aula'),
+        observacoes=a.get('observacoes'),
+        descricao=a.get('descricao'),
+        link_arquivos=a.get('linkDrive') or a.get('link_arquivos')
+    )
+
+
+class _Importacao:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lote = []
+        self.conflitos = []
+        self.total_conflitos = 0
+
+    def adicionar(self, aula):
+        self.lote.append(aula)
+        if len(self.lote) >= AULAS_POR_LOTE:
+            self.gravar_lote()
+
+    def gravar_lote(self):
+        if not self.lote:
+            return
+        lote, self.lote = self.lote, []
+
+        # Duplicadas (ver chave_aula): uma consulta por lote em cada camada
+        existentes = chaves_existentes(lote)
+        novas = []
+        for aula in lote:
+            chave = chave_aula(aula)
+            if chave not in existentes:
+                existentes.add(chave)
+                novas.append(aula)
+        if not novas:
+            return
+
+        db.session.add_all(novas)
+        db.session.flush()
+
+        conflitos = detectar_conflitos(self.user_id, [
+            {'data': a.data, 'turno': a.turno, 'sala': a.sala, 'unidade_predio': a.unidade_predio,
+             'ministrante_id': a.ministrante_id, 'titulo': a.titulo}
+            for a in novas
+        ], ignorar_ids={a.id for a in novas})
+        for pos, msgs in sorted(conflitos.items()):
+            for msg in msgs:
+                self.total_conflitos += 1
+                if len(self.conflitos) < MAX_MENSAGENS_CONFLITO:
+                    self.conflitos.append(
+                        f'Aula "{novas[pos].titulo}" ({novas[pos].data.strftime("%d/%m/%Y")}): {msg}')
+
+        # Commit por lote: não segura o banco durante a restauração inteira
+        db.session.commit()
+
+
+def importar_registros(registros, user_id, email_esperado=None):
+    """
+    Consome os registros de ler_backup/registros_do_dicionario, criando turmas
+    e inserindo as aulas em lotes. Aulas já existentes são ignoradas; conflitos de
+    sala/ministrante são apenas reportados. Retorna a lista de mensagens de conflito.
+    Com email_esperado, interrompe (BackupDeOutroUsuario) se o backup for de outra pessoa.
+    """
+    importacao = _Importacao(user_id)
+    mapa_indices = {}   # posição da turma no backup -> id local
+    mapa_ids = {}       # id antigo (formato legado) -> id local
+    email_conferido = email_esperado is None
+
+    for registro in registros:
+        tipo = registro[0]
+        if tipo == 'email':
+            if email_esperado is not None and registro[1] != email_esperado:
+                raise BackupDeOutroUsuario(registro[1])
+            email_conferido = True
+            continue
+        if not email_conferido:
+            raise BackupDeOutroUsuario(None)
+
+        if tipo == 'turma':
+            _, indice, t = registro
+            turma_id = _obter_turma(t, user_id)
+            mapa_indices[indice] = turma_id
+            if t.get('id') is not None:
+                mapa_ids[t['id']] = turma_id
+
+        elif tipo == 'aula':
+            _, indice, a = registro
+            if indice is not None:
+                turma_id = mapa_indices.get(indice)
+            else:
+                turma_id = mapa_ids.get(a.get('turmaId')) or mapa_ids.get(a.get('turma_id'))
+            if turma_id:
+                importacao.adicionar(_nova_aula(a, turma_id, user_id))
+
+    importacao.gravar_lote()
+    # Turmas desativadas do backup: as aulas restauradas vão para o arquivo
+    sincronizar_camadas(set(mapa_indices.values()) | set(mapa_ids.values()))
+    db.session.commit()
+
+    if importacao.total_conflitos > len(importacao.conflitos):
+        importacao.conflitos.append(f'… e mais {importacao.total_conflitos - len(importacao.conflitos)} conflito(s).')
+    return importacao.conflitos
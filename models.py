@@ -1,8 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import declared_attr
 from datetime import datetime
+import json
+import uuid
 
-db = SQLAlchemy()
+from tenants import RoteadorSession
+
+# MENTORIA: a sessão roteia turmas/aulas para o banco do professor quando TENANT_MODE está ligado (ver tenants.py)
+db = SQLAlchemy(session_options={'class_': RoteadorSession})
 
 # Modelo de Usuário
 class User(UserMixin, db.Model):
@@ -46,6 +52,7 @@ class Turma(db.Model):
     
     # Cascade all garante que se deletar a turma, as aulas somem (evita aulas órfãs)
     aulas = db.relationship('Aula', backref='turma', cascade="all, delete-orphan", lazy=True)
+    aulas_arquivadas = db.relationship('AulaArquivada', back_populates='turma', cascade="all, delete-orphan", lazy=True)
 
     def to_dict(self):
         return {
@@ -54,17 +61,19 @@ class Turma(db.Model):
             "unidade_curricular": self.unidade_curricular,
             "link_diario": self.link_diario,
             "ativa": self.ativa,
-            "aulas": [a.to_dict() for a in self.aulas]
+            # O backup leva as duas camadas (turma desativada tem as aulas no arquivo)
+            "aulas": [a.to_dict() for a in self.aulas] + [a.to_dict() for a in self.aulas_arquivadas]
         }
 
-# Modelo de Aula
-class Aula(db.Model):
+# Campos comuns à Aula e à AulaArquivada
+class CamposAula:
+    # MENTORIA: Aulas de turmas desativadas vão para a tabela aula_arquivada (ver
+    # arquivo_turmas.py); as duas tabelas têm exatamente as mesmas colunas.
     id = db.Column(db.Integer, primary_key=True)
     turma_id = db.Column(db.Integer, db.ForeignKey('turma.id'), nullable=False)
     professor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     
     ministrante_id = db.Column(db.Integer, db.ForeignKey('professor_adjunto.id'), nullable=True)
-    ministrante_rel = db.relationship('ProfessorAdjunto', backref='aulas_ministradas')
 
     titulo = db.Column(db.String(200), nullable=False)
     data = db.Column(db.Date, nullable=False)
@@ -80,8 +89,15 @@ class Aula(db.Model):
     observacoes = db.Column(db.String(200))
     link_arquivos = db.Column(db.String(200))
 
+    # Versão da linha: muda a cada UPDATE (version_id_col em Aula). É um valor aleatório
+    # e não um contador porque bancos antigos (sem AUTOINCREMENT) reaproveitavam ids de
+    # aulas apagadas, e o cache de fragmentos (fragmentos.py) não pode confundir a aula
+    # nova com a antiga.
+    versao = db.Column(db.String(32), default=lambda: uuid.uuid4().hex)
+
     def to_json(self):
         # Usado para o Modal de Edição (Frontend) - AJAX
+        turma = self.turma  # um único acesso ao relacionamento
         return {
             'id': self.id,
             'turma_id': self.turma_id,  
@@ -96,8 +112,8 @@ class Aula(db.Model):
             'descricao': self.descricao,
             'link_arquivos': self.link_arquivos,
             'observacoes': self.observacoes,
-            'turma_nome': self.turma.nome,
-            'codigo': self.turma.codigo_completo,
+            'turma_nome': turma.nome,
+            'codigo': turma.codigo_completo,
             'ministrante_id': self.ministrante_id or 'me'
         }
 
@@ -119,3 +135,195 @@ class Aula(db.Model):
             "link_arquivos": self.link_arquivos,   # Novo
             "ministrante_nome": self.ministrante_rel.nome if self.ministrante_rel else None # Opcional, ajuda na auditoria
         }
+
+# Modelo de Aula
+class Aula(CamposAula, db.Model):
+    ministrante_rel = db.relationship('ProfessorAdjunto', backref='aulas_ministradas')
+
+    @declared_attr.directive
+    def __mapper_args__(cls):
+        return {
+            'version_id_col': cls.__table__.c.versao,
+            'version_id_generator': lambda atual: uuid.uuid4().hex,
+        }
+
+    __table_args__ = (
+        db.Index('ix_aula_turma_data', 'turma_id', 'data'),
+        # Usados na detecção de conflitos de sala e de ministrante
+        db.Index('ix_aula_data_turno_sala', 'data', 'turno', 'sala'),
+        db.Index('ix_aula_data_turno_ministrante', 'data', 'turno', 'ministrante_id'),
+        # O id acompanha a aula quando ela vai para o arquivo e volta (UID do .ics,
+        # feed de alterações, cache de fragmentos): o SQLite não pode reaproveitá-lo
+        {'sqlite_autoincrement': True},
+    )
+
+# Modelo de Aula Arquivada (camada fria: aulas de turmas desativadas)
+class AulaArquivada(CamposAula, db.Model):
+    turma = db.relationship('Turma', back_populates='aulas_arquivadas')
+    ministrante_rel = db.relationship('ProfessorAdjunto')
+
+    __table_args__ = (
+        db.Index('ix_aula_arquivada_turma_data', 'turma_id', 'data'),
+    )
+
+# Modelo de Operação assíncrona no Google Drive
+class OperacaoDrive(db.Model):
+    # MENTORIA: Guardamos o status no banco (e não em memória) porque com vários
+    # workers do gunicorn a consulta de status pode cair em outro processo.
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)           # upload, restore, listar, sincronizar
+    status = db.Column(db.String(20), default='pendente')     # pendente, executando, concluida, erro
+    mensagem = db.Column(db.String(300))
+    resultado = db.Column(db.Text)                            # JSON opcional com o retorno
+    criado_em = db.Column(db.DateTime, default=datetime.now)
+    concluido_em = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "status": self.status,
+            "mensagem": self.mensagem,
+            "resultado": json.loads(self.resultado) if self.resultado else None,
+            "criado_em": self.criado_em.isoformat() if self.criado_em else None,
+            "concluido_em": self.concluido_em.isoformat() if self.concluido_em else None
+        }
+
+# Modelo de Resumo por Turma (estatísticas materializadas)
+class ResumoTurma(db.Model):
+    # MENTORIA: Mantido a cada escrita de aula (ver resumo_turmas.py), assim os
+    # painéis leem uma linha por turma em vez de carregar todas as aulas.
+    turma_id = db.Column(db.Integer, db.ForeignKey('turma.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+    qtd_planejando = db.Column(db.Integer, default=0)
+    qtd_preparar = db.Column(db.Integer, default=0)
+    qtd_pronta = db.Column(db.Integer, default=0)
+    qtd_entregue = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
+
+    proxima_aula_id = db.Column(db.Integer)
+    proxima_aula_data = db.Column(db.Date)
+    proxima_aula_titulo = db.Column(db.String(200))
+    ultima_entregue_id = db.Column(db.Integer)
+    ultima_entregue_data = db.Column(db.Date)
+    ultima_entregue_titulo = db.Column(db.String(200))
+
+    # Dia usado como referência para "próxima aula" (recalcula quando virar o dia)
+    calculado_em = db.Column(db.Date)
+
+
+def criar_indices_faltantes(engine, tabelas=None):
+    """O create_all não cria índices novos em tabelas que já existem no banco."""
+    for tabela in (tabelas if tabelas is not None else db.metadata.sorted_tables):
+        for indice in tabela.indexes:
+            indice.create(bind=engine, checkfirst=True)
+
+def criar_colunas_faltantes(engine, tabelas=None):
+    """
+    O create_all também não acrescenta colunas: cria com ALTER TABLE as que faltam em
+    tabelas existentes e preenche as linhas antigas com o default da coluna (um valor
+    por linha se for função).
+    """
+    inspetor = db.inspect(engine)
+    with engine.begin() as conn:
+        for tabela in (tabelas if tabelas is not None else db.metadata.sorted_tables):
+            if not inspetor.has_table(tabela.name):
+                continue
+            existentes = {c['name'] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name in existentes:
+                    continue
+                preparador = engine.dialect.identifier_preparer
+                tipo = coluna.type.compile(dialect=engine.dialect)
+                conn.execute(db.text(
+                    f'ALTER TABLE {preparador.format_table(tabela)} ADD COLUMN {preparador.format_column(coluna)} {tipo}'
+                ))
+                default = coluna.default
+                if default is None:
+                    continue
+                if default.is_scalar:
+                    conn.execute(db.update(tabela).values({coluna.name: default.arg}))
+                elif default.is_callable:
+                    pk = list(tabela.primary_key.columns)[0]
+                    ids = conn.execute(db.select(pk)).scalars().all()
+                    if ids:
+                        conn.execute(
+                            db.update(tabela).where(pk == db.bindparam('_pk')).values({coluna.name: db.bindparam('_valor')}),
+                            [{'_pk': i, '_valor': default.arg(None)} for i in ids]
+                        )
+
+def criar_autoincremento_aula(engine):
+    """
+    Bancos criados antes do AUTOINCREMENT na tabela aula: recria a tabela (o SQLite
+    não altera isso com ALTER TABLE) e começa a sequência acima do maior id do
+    arquivo, para que nenhuma aula nova pegue o id de uma aula arquivada.
+    """
+    if engine.url.get_backend_name() != 'sqlite':
+        return
+    tabela = Aula.__table__
+    with engine.begin() as conn:
+        sql = conn.execute(db.text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :nome"
+        ), {'nome': tabela.name}).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return
+
+        antiga = f'{tabela.name}_sem_autoincremento'
+        conn.execute(db.text(f'ALTER TABLE {tabela.name} RENAME TO {antiga}'))
+        # Os índices acompanham a tabela renomeada; saem para a nova poder criá-los
+        for (indice,) in conn.execute(db.text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :nome AND sql IS NOT NULL"
+        ), {'nome': antiga}).all():
+            conn.execute(db.text(f'DROP INDEX {indice}'))
+        tabela.create(conn)
+        colunas = ', '.join(c.name for c in tabela.columns)
+        conn.execute(db.text(f'INSERT INTO {tabela.name} ({colunas}) SELECT {colunas} FROM {antiga}'))
+        conn.execute(db.text(f'DROP TABLE {antiga}'))
+
+        maior = conn.execute(db.select(db.func.max(AulaArquivada.__table__.c.id))).scalar()
+        if maior:
+            conn.execute(db.text("DELETE FROM sqlite_sequence WHERE name = :nome AND seq < :maior"),
+                         {'nome': tabela.name, 'maior': maior})
+            conn.execute(db.text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :nome, :maior "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :nome)"
+            ), {'nome': tabela.name, 'maior': maior})
+
+# Modelo de Versão dos Dados por usuário (incrementada a cada escrita)
+class VersaoDados(db.Model):
+    # MENTORIA: Serve de validador barato para caches e ETags (ver versao_dados.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=1)
+    atualizado_em = db.Column(db.DateTime, default=datetime.now)
+
+# Modelo de Token do feed de calendário (iCal)
+class TokenCalendario(db.Model):
+    token = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    turma_id = db.Column(db.Integer, db.ForeignKey('turma.id'), nullable=True)  # None = todas as turmas ativas
+    criado_em = db.Column(db.DateTime, default=datetime.now)
+
+# Modelo do Log de Alterações (feed incremental para os clientes)
+class Alteracao(db.Model):
+    # MENTORIA: Só cresce; o id é o cursor do /api/changes. Gravado na mesma transação
+    # da escrita (ver alteracoes.py) e compactado/podado periodicamente.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    entidade = db.Column(db.String(20), nullable=False)      # aula, turma, professor
+    entidade_id = db.Column(db.Integer, nullable=False)
+    operacao = db.Column(db.String(10), nullable=False)      # upsert, delete
+    dados = db.Column(db.Text)                               # JSON com os campos (upsert)
+    criado_em = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_alteracao_user_id', 'user_id', 'id'),
+        # AUTOINCREMENT: o SQLite não reaproveita ids apagados, o cursor nunca volta
+        {'sqlite_autoincrement': True},
+    )
+
+# Até onde o log de cada usuário já foi podado pela retenção
+class CorteAlteracao(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    ultimo_id_removido = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import g, has_app_context, has_request_context, request, session
+
+# DATABASE_READ_URL: URL de uma réplica de leitura, ou "sqlite-ro" para abrir os
+# mesmos arquivos SQLite em modo somente leitura (com WAL, leitores não bloqueiam a escrita).
+SQLITE_RO = 'sqlite-ro'
+
+_config = {'url': None, 'grudar_segundos': 5}
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def configurar(app):
+    _config['url'] = (app.config.get('DATABASE_READ_URL') or '').strip() or None
+    _config['grudar_segundos'] = float(app.config.get('READ_STICKY_SECONDS') or 5)
+
+    if _config['url']:
+        @app.after_request
+        def _grudar_no_primario(resposta):
+            # Read-your-writes: depois de uma escrita, as próximas leituras do mesmo
+            # navegador vão para o primário até a réplica ter tempo de alcançar
+            if request.method not in ('GET', 'HEAD', 'OPTIONS') or g.get('_escreveu'):
+                session['_ler_primario_ate'] = time.time() + _config['grudar_segundos']
+            return resposta
+
+
+def ativo():
+    return _config['url'] is not None
+
+
+def preparar_primario(engine):
+    """No modo sqlite-ro liga o WAL no arquivo (a configuração fica gravada nele)."""
+    if _config['url'] == SQLITE_RO and engine.url.get_backend_name() == 'sqlite':
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+
+
+def engine_de_leitura(primario, principal):
+    """
+    Engine de leitura correspondente a `primario`. `principal` é o engine do
+    DATABASE_URL; a réplica por URL só existe para ele (os arquivos de tenant só
+    ganham leitura no modo sqlite-ro). Sem correspondente, devolve o próprio primário.
+    """
+    chave = str(primario.url)
+    engine = _engines.get(chave)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(chave)
+        if engine is None:
+            engine = _criar_engine_de_leitura(primario, principal)
+            _engines[chave] = engine
+    return engine
+
+
+def _criar_engine_de_leitura(primario, principal):
+    if _config['url'] != SQLITE_RO:
+        return sa.create_engine(_config['url']) if primario is principal else primario
+    if primario.url.get_backend_name() != 'sqlite' or not primario.url.database:
+        return primario
+    caminho = primario.url.database
+    # "sqlite://" seria tratado como banco em memória (SingletonThreadPool, que fecha
+    # conexões de outras threads em uso): aqui é um arquivo, com pool normal
+    return sa.create_engine(
+        'sqlite://',
+        creator=lambda: sqlite3.connect(f'file:{caminho}?mode=ro', uri=True, check_same_thread=False),
+        poolclass=sa.pool.QueuePool,
+    )
+
+
+def em_leitura():
+    return has_app_context() and g.get('_somente_leitura', False) and not g.get('_escreveu', False)
+
+
+def marcar_escrita():
+    """Chamado quando a sessão grava algo: o resto do app context lê do primário."""
+    if has_app_context():
+        g._escreveu = True
+
+
+def _grudado():
+    # Jobs em segundo plano não têm sessão de navegador: nunca ficam grudados
+    return has_request_context() and session.get('_ler_primario_ate', 0) > time.time()
+
+
+@contextmanager
+def leitura():
+    """Bloco que só lê (ex.: serializar o backup); as consultas vão para a réplica."""
+    anterior = g.get('_somente_leitura', False)
+    # Mesma regra do @somente_leitura: logo após um POST do usuário, lê do primário
+    g._somente_leitura = ativo() and not _grudado()
+    try:
+        yield
+    finally:
+        g._somente_leitura = anterior
+
+
+def somente_leitura(view):
+    """
+    Rotas GET que não gravam nada. Vale também para respostas em streaming, porque
+    a marca fica no app context. Logo após um POST do mesmo usuário, lê do primário.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ativo() or _grudado():
+            return view(*args, **kwargs)
+        g._somente_leitura = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def copiar_sqlite(origem, destino):
+    """Copia um arquivo SQLite de forma consistente (API de backup), mesmo com escritas em andamento."""
+    with closing(sqlite3.connect(origem)) as fonte, closing(sqlite3.connect(destino)) as alvo:
+        fonte.backup(alvo)
@@ -0,0 +1,172 @@
+from datetime import date
+
+from sqlalchemy import event, func, inspect, select, delete, insert
+from sqlalchemy.orm import Session
+
+from models import db, Turma, Aula, AulaArquivada, ResumoTurma
+
+# Status "oficiais"; qualquer outro valor (ex.: o default antigo 'Planejar') conta como Planejando
+STATUS_COLUNAS = {
+    'Planejando': 'qtd_planejando',
+    'Preparar': 'qtd_preparar',
+    'Pronta': 'qtd_pronta',
+    'Entregue': 'qtd_entregue',
+}
+
+
+def atualizar_resumos(conn, turma_ids, hoje=None):
+    """Recalcula as linhas de ResumoTurma das turmas informadas usando a conexão dada."""
+    turma_ids = {int(t) for t in turma_ids if t is not None}
+    if not turma_ids:
+        return
+    hoje = hoje or date.today()
+    resumo = ResumoTurma.__table__
+    turma = Turma.__table__
+
+    donos = conn.execute(
+        select(turma.c.id, turma.c.user_id, turma.c.ativa).where(turma.c.id.in_(turma_ids))
+    ).all()
+
+    # Turma desativada tem as aulas no arquivo (ver arquivo_turmas.py)
+    camadas = {}
+    linhas = {}
+    for turma_id, user_id, ativa in donos:
+        camadas.setdefault(Aula.__table__ if ativa is not False else AulaArquivada.__table__, []).append(turma_id)
+        linhas[turma_id] = {
+            'turma_id': turma_id, 'user_id': user_id, 'calculado_em': hoje,
+            'qtd_planejando': 0, 'qtd_preparar': 0, 'qtd_pronta': 0, 'qtd_entregue': 0, 'total': 0,
+            'proxima_aula_id': None, 'proxima_aula_data': None, 'proxima_aula_titulo': None,
+            'ultima_entregue_id': None, 'ultima_entregue_data': None, 'ultima_entregue_titulo': None,
+        }
+
+    for aula, ids in camadas.items():
+        contagens = conn.execute(
+            select(aula.c.turma_id, aula.c.status, func.count())
+            .where(aula.c.turma_id.in_(ids))
+            .group_by(aula.c.turma_id, aula.c.status)
+        ).all()
+        for turma_id, status, qtd in contagens:
+            linha = linhas[turma_id]
+            linha[STATUS_COLUNAS.get(status, 'qtd_planejando')] += qtd
+            linha['total'] += qtd
+
+    # Próxima e última entregue: uma busca indexada (turma_id, data) por turma alterada
+    for aula, ids in camadas.items():
+        for turma_id in ids:
+            _preencher_datas(conn, aula, turma_id, linhas[turma_id], hoje)
+
+    # Turmas que não existem mais (excluídas) simplesmente perdem a linha
+    conn.execute(delete(resumo).where(resumo.c.turma_id.in_(turma_ids)))
+    if linhas:
+        conn.execute(insert(resumo), list(linhas.values()))
+
+
+def _preencher_datas(conn, aula, turma_id, linha, hoje):
+    if not linha['total']:
+        return
+    proxima = conn.execute(
+        select(aula.c.id, aula.c.data, aula.c.titulo)
+        .where(aula.c.turma_id == turma_id, aula.c.data >= hoje)
+        .order_by(aula.c.data.asc()).limit(1)
+    ).first()
+    if proxima:
+        linha['proxima_aula_id'], linha['proxima_aula_data'], linha['proxima_aula_titulo'] = proxima
+
+    ultima = conn.execute(
+        select(aula.c.id, aula.c.data, aula.c.titulo)
+        .where(aula.c.turma_id == turma_id, aula.c.status == 'Entregue')
+        .order_by(aula.c.data.desc()).limit(1)
+    ).first()
+    if ultima:
+        linha['ultima_entregue_id'], linha['ultima_entregue_data'], linha['ultima_entregue_titulo'] = ultima
+
+
+def reconstruir_resumos(user_id=None):
+    """Recalcula do zero o resumo de todas as turmas (ou só as de um usuário)."""
+    consulta = select(Turma.id)
+    if user_id is not None:
+        consulta = consulta.where(Turma.user_id == user_id)
+    turma_ids = db.session.execute(consulta).scalars().all()
+
+    conn = db.session.connection(bind_arguments={'mapper': ResumoTurma})
+    limpeza = delete(ResumoTurma.__table__)
+    if user_id is not None:
+        limpeza = limpeza.where(ResumoTurma.__table__.c.user_id == user_id)
+    conn.execute(limpeza)
+    atualizar_resumos(conn, turma_ids)
+    db.session.commit()
+    return len(turma_ids)
+
+
+def resumos_do_usuario(user_id, somente_ativas=False):
+    """
+    Retorna {turma_id: ResumoTurma} lendo apenas a tabela de resumo, sem gravar nada
+    (as rotas que usam isto são só de leitura). Se a "próxima aula" de uma linha já
+    passou, ela é recalculada para hoje só em memória; o agendador atualiza a tabela
+    uma vez por dia (ver atualizar_resumos_vencidos).
+    """
+    consulta = ResumoTurma.query.filter_by(user_id=user_id)
+    if somente_ativas:
+        consulta = consulta.join(Turma, Turma.id == ResumoTurma.turma_id).filter(Turma.ativa == True)
+    resumos = consulta.all()
+
+    hoje = date.today()
+    passadas = [r for r in resumos if r.proxima_aula_data is not None and r.proxima_aula_data < hoje]
+    if passadas:
+        ativas = dict(db.session.execute(
+            select(Turma.id, Turma.ativa).where(Turma.id.in_([r.turma_id for r in passadas]))
+        ).all())
+        for r in passadas:
+            # Fora da sessão: o ajuste vale só para esta página e nunca vai para o banco
+            db.session.expunge(r)
+            aula = Aula.__table__ if ativas.get(r.turma_id) is not False else AulaArquivada.__table__
+            proxima = db.session.execute(
+                select(aula.c.id, aula.c.data, aula.c.titulo)
+                .where(aula.c.turma_id == r.turma_id, aula.c.data >= hoje)
+                .order_by(aula.c.data.asc()).limit(1)
+            ).first()
+            r.proxima_aula_id, r.proxima_aula_data, r.proxima_aula_titulo = proxima or (None, None, None)
+
+    return {r.turma_id: r for r in resumos}
+
+
+def atualizar_resumos_vencidos(user_id=None):
+    """Recalcula as linhas calculadas antes de hoje (job diário do agendador)."""
+    consulta = select(ResumoTurma.turma_id).where(ResumoTurma.calculado_em != date.today())
+    if user_id is not None:
+        consulta = consulta.where(ResumoTurma.user_id == user_id)
+    turma_ids = db.session.execute(consulta).scalars().all()
+    if turma_ids:
+        atualizar_resumos(db.session.connection(bind_arguments={'mapper': ResumoTurma, 'escrita': True}), turma_ids)
+        db.session.commit()
+    return len(turma_ids)
+
+
+def totais(resumos):
+    """Soma os contadores de vários resumos para o painel geral."""
+    soma = {coluna: 0 for coluna in list(STATUS_COLUNAS.values()) + ['total']}
+    for r in resumos:
+        for coluna in soma:
+            soma[coluna] += getattr(r, coluna) or 0
+    return soma
+
+
+def _turmas_alteradas(session):
+    turma_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Aula):
+            turma_ids.add(obj.turma_id)
+            # Aula movida de turma: a turma antiga também precisa ser recalculada
+            historico = inspect(obj).attrs.turma_id.history
+            turma_ids.update(historico.deleted or ())
+        elif isinstance(obj, Turma) and obj in session.deleted:
+            turma_ids.add(obj.id)
+    return turma_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _manter_resumo(session, flush_context):
+    # Roda na mesma transação da escrita: resumo e aulas nunca divergem
+    turma_ids = _turmas_alteradas(session)
+    if turma_ids:
+        atualizar_resumos(session.connection(bind_arguments={'mapper': ResumoTurma}), turma_ids)
@@ -0,0 +1,85 @@
+import re
+from datetime import datetime, timezone
+
+# Padrão: um por hora nas últimas 48h, um por dia nos últimos 30 dias, um por mês por 12 meses
+POLITICA_PADRAO = {'horas': 48, 'dias': 30, 'meses': 12}
+
+# Backups antigos (sem appProperties): só os automáticos têm o dono no nome
+# ("backup_AUTO_<nome>_<data>"); os manuais antigos nunca são apagados
+_AUTO_ANTIGO = re.compile(r'^(backup_AUTO_.+?)_\d{4}-\d{2}-\d{2}')
+
+
+def ler_politica(texto):
+    """Lê "horas=48,dias=30,meses=12" (chaves omitidas ficam com o padrão)."""
+    politica = dict(POLITICA_PADRAO)
+    for parte in (texto or '').split(','):
+        if '=' not in parte:
+            continue
+        chave, valor = (p.strip() for p in parte.split('=', 1))
+        if chave not in politica:
+            raise ValueError(f"Chave de retenção desconhecida: {chave}")
+        politica[chave] = int(valor)
+    return politica
+
+
+def _data(arquivo):
+    return datetime.fromisoformat(arquivo['createdTime'].replace('Z', '+00:00'))
+
+
+def _grupo(arquivo):
+    user_id = (arquivo.get('appProperties') or {}).get('user_id')
+    if user_id:
+        return 'user', user_id
+    nome = _AUTO_ANTIGO.match(arquivo.get('name', ''))
+    return ('nome', nome.group(1)) if nome else None
+
+
+def _vaga(data, agora, politica):
+    """Em qual "vaga" da política o backup cai; None = passou de todas."""
+    idade = agora - data
+    if idade.total_seconds() <= politica['horas'] * 3600:
+        return 'hora', data.strftime('%Y-%m-%d %H')
+    if idade.days < politica['dias']:
+        return 'dia', data.strftime('%Y-%m-%d')
+    meses = (agora.year - data.year) * 12 + (agora.month - data.month)
+    if meses < politica['meses']:
+        return 'mes', data.strftime('%Y-%m')
+    return None
+
+
+def selecionar_para_apagar(arquivos, politica=POLITICA_PADRAO, agora=None):
+    """
+    Aplica a política a cada dono separadamente: de cada vaga (hora, dia ou mês,
+    conforme a idade) fica só o backup mais novo. O mais recente de cada dono
+    nunca é apagado, mesmo que seja antigo.
+    """
+    agora = agora or datetime.now(timezone.utc)
+    grupos = {}
+    for arquivo in arquivos:
+        grupo = _grupo(arquivo)
+        if grupo is not None:
+            grupos.setdefault(grupo, []).append(arquivo)
+
+    apagar = []
+    for lista in grupos.values():
+        lista.sort(key=_data, reverse=True)
+        ocupadas = set()
+        for i, arquivo in enumerate(lista):
+            vaga = _vaga(_data(arquivo), agora, politica)
+            if i == 0 or (vaga is not None and vaga not in ocupadas):
+                ocupadas.add(vaga)
+                continue
+            apagar.append(arquivo)
+    return apagar
+
+
+def aplicar_retencao(servico, politica=POLITICA_PADRAO, agora=None, simular=False):
+    """
+    Lista todos os backups (todas as páginas) e apaga o que a política descarta.
+    Retorna (total_listado, lista_para_apagar, quantos_apagados).
+    """
+    arquivos = list(servico.iter_backups())
+    apagar = selecionar_para_apagar(arquivos, politica, agora)
+    if simular or not apagar:
+        return len(arquivos), apagar, 0
+    return len(arquivos), apagar, servico.delete_backups([a['id'] for a in apagar])
@@ -0,0 +1,174 @@
+"""
+Benchmark de renderização do dashboard: compara o mês/semana "cheios" com e sem o
+cache de fragmentos (cards de aula e modal, ver fragmentos.py) e a compilação a frio
+dos templates com e sem o cache de bytecode do Jinja.
+
+Uso (na raiz do projeto):
+    python scripts/bench_templates.py --por-turno 3 --repeticoes 30
+
+Cada medição de "frio" roda num processo novo, como um worker do gunicorn subindo.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES = ['dashboard.html', 'gerenciar_aulas.html', 'base.html',
+             'components/modal_form_aula.html', 'components/card_aula.html', 'components/card_aula_mini.html']
+
+
+def _preparar_ambiente(pasta):
+    os.environ['SECRET_KEY'] = 'bench'
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(pasta, 'planner.db')}"
+    os.environ['BACKUP_BACKEND'] = 'local'
+    os.environ['BACKUP_LOCAL_DIR'] = os.path.join(pasta, 'backups')
+    os.environ['JINJA_CACHE_DIR'] = os.path.join(pasta, 'jinja_cache')
+    sys.path.insert(0, RAIZ)
+
+
+def compilar(pasta, usar_cache):
+    """Modo filho: carrega os templates num processo novo e imprime o tempo em ms."""
+    _preparar_ambiente(pasta)
+    from app import app
+    if not usar_cache:
+        app.jinja_env.bytecode_cache = None
+    inicio = time.perf_counter()
+    for nome in TEMPLATES:
+        app.jinja_env.get_template(nome)
+    print(json.dumps({'ms': (time.perf_counter() - inicio) * 1000}))
+
+
+def _medir_frio(pasta, usar_cache, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run(
+            [sys.executable, __file__, '--_compilar', 'com' if usar_cache else 'sem', '--_pasta', pasta],
+            capture_output=True, text=True, check=True, cwd=RAIZ,
+        ).stdout
+        tempos.append(json.loads(saida.strip().splitlines()[-1])['ms'])
+    return tempos
+
+
+def popular(por_turno, turmas):
+    """Um usuário com `por_turno` aulas em cada turno de cada dia de 7 semanas em volta do mês atual."""
+    from werkzeug.security import generate_password_hash
+    from app import app
+    from models import db, User, Turma, Aula
+
+    hoje = date.today()
+    inicio = hoje.replace(day=1) - timedelta(days=7)
+    with app.app_context():
+        user = User(email='bench@teste', nome='Bench', password=generate_password_hash('bench', method='pbkdf2:sha256'))
+        db.session.add(user)
+        db.session.flush()
+        lista = [Turma(user_id=user.id, nome=f'Turma {t}', ativa=True) for t in range(turmas)]
+        db.session.add_all(lista)
+        db.session.flush()
+        n = 0
+        for d in range(49):
+            for turno in ('Manhã', 'Tarde', 'Noite'):
+                for i in range(por_turno):
+                    turma = lista[n % turmas]
+                    n += 1
+                    db.session.add(Aula(
+                        turma_id=turma.id, professor_id=user.id, titulo=f'Aula {n} - {turma.nome}',
+                        data=inicio + timedelta(days=d), turno=turno,
+                        status=['Planejando', 'Preparar', 'Pronta', 'Entregue'][n % 4], sala=f'S{n % 12}',
+                    ))
+        db.session.commit()
+    return n
+
+
+def _medir_quente(app, cliente, url, repeticoes):
+    """Tempos (ms) da requisição inteira e só da renderização do dashboard.html."""
+    from flask import before_render_template, template_rendered
+
+    marcas = []
+    renders = []
+
+    def _antes(sender, template, context, **extra):
+        if template.name == 'dashboard.html':
+            marcas.append(time.perf_counter())
+
+    def _depois(sender, template, context, **extra):
+        if template.name == 'dashboard.html':
+            renders.append((time.perf_counter() - marcas.pop()) * 1000)
+
+    cliente.get(url)  # aquece (e, com o cache ligado, preenche os fragmentos)
+    tempos = []
+    with before_render_template.connected_to(_antes, app), template_rendered.connected_to(_depois, app):
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            resposta = cliente.get(url)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            assert resposta.status_code == 200, resposta.status_code
+    return tempos, renders
+
+
+def _resumo(tempos):
+    tempos = sorted(tempos)
+    return {'media': statistics.mean(tempos), 'p50': tempos[len(tempos) // 2], 'p95': tempos[int(len(tempos) * 0.95) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--por-turno', type=int, default=3, help='Aulas por turno por dia (padrão 3).')
+    parser.add_argument('--turmas', type=int, default=8)
+    parser.add_argument('--repeticoes', type=int, default=30)
+    parser.add_argument('--frio', type=int, default=5, help='Processos novos por medição a frio.')
+    parser.add_argument('--json', help='Grava o resultado neste arquivo.')
+    parser.add_argument('--_compilar', choices=['com', 'sem'], help=argparse.SUPPRESS)
+    parser.add_argument('--_pasta', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._compilar:
+        compilar(args._pasta, args._compilar == 'com')
+        return
+
+    pasta = tempfile.mkdtemp(prefix='bench_templates_')
+    _preparar_ambiente(pasta)
+    total = popular(args.por_turno, args.turmas)
+    print(f"{total} aula(s) em 7 semanas ({args.por_turno} por turno/dia), banco em {pasta}")
+
+    import fragmentos
+    from app import app
+    cliente = app.test_client()
+    cliente.post('/login', data={'email': 'bench@teste', 'password': 'bench'})
+
+    resultado = {'aulas': total, 'quente': {}, 'frio': {}}
+    for url in ('/?view=mensal', '/?view=semanal'):
+        for ligado in (False, True):
+            app.config['FRAGMENTOS_MAX'] = 5000 if ligado else 0
+            fragmentos._config['max'] = app.config['FRAGMENTOS_MAX']
+            fragmentos.limpar()
+            chave = f"{url} fragmentos={'on' if ligado else 'off'}"
+            tempos, renders = _medir_quente(app, cliente, url, args.repeticoes)
+            resultado['quente'][chave] = {'requisicao': _resumo(tempos), 'render': _resumo(renders)}
+
+    # O primeiro processo com cache grava o bytecode; os seguintes só leem
+    _medir_frio(pasta, True, 1)
+    for usar_cache in (False, True):
+        chave = f"bytecode={'on' if usar_cache else 'off'}"
+        resultado['frio'][chave] = _resumo(_medir_frio(pasta, usar_cache, args.frio))
+
+    print("\nProcesso aquecido (ms): renderização do template | requisição completa")
+    for chave, r in resultado['quente'].items():
+        render, req = r['render'], r['requisicao']
+        print(f"  {chave:<38} render p50 {render['p50']:6.1f} p95 {render['p95']:6.1f} | req p50 {req['p50']:6.1f} p95 {req['p95']:6.1f}")
+    print("\nCompilação dos templates num processo novo (ms):")
+    for chave, r in resultado['frio'].items():
+        print(f"  {chave:<38} média {r['media']:7.1f}  p50 {r['p50']:7.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
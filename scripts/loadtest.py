@@ -0,0 +1,336 @@
+"""
+Teste de carga de ponta a ponta: sobe o app:app de verdade no gunicorn, contra um
+SQLite populado e o backup local (BACKUP_BACKEND=local), e repete um uso realista
+(login, dashboard semana/mês, filtros do Gerenciar Aulas, modal /aula/detalhes e
+edições) para cada combinação de workers/threads/worker-class.
+
+Uso (na raiz do projeto):
+    python scripts/loadtest.py --matriz 2x2,4x1,1x4,4x4:gthread --concorrencia 16 --duracao 20
+
+Formato de cada item da matriz: WORKERSxTHREADS[:worker-class] (ex.: 2x2, 4x1:sync, 8:gevent).
+Só usa a biblioteca padrão no cliente; o servidor precisa do gunicorn instalado.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENHA = 'carga123'
+
+# Peso de cada ação no uso simulado (soma não precisa dar 100)
+MIX = [
+    ('dashboard_semana', 30),
+    ('dashboard_navegar', 15),
+    ('dashboard_mes', 10),
+    ('gerenciar', 12),
+    ('gerenciar_filtro', 10),
+    ('get_aula', 15),
+    ('editar_aula', 5),
+    ('login', 3),
+]
+
+
+# ------------------------------------------------------------------
+# Massa de dados
+# ------------------------------------------------------------------
+
+def popular(pasta, usuarios, turmas_por_usuario, aulas_por_turma):
+    """Cria o banco de partida usando os próprios modelos do app. Retorna o mapa de ids por usuário."""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(pasta, 'planner.db')}"
+    os.environ['BACKUP_LOCAL_DIR'] = os.path.join(pasta, 'backups')
+    os.environ['TENANT_DIR'] = os.path.join(pasta, 'tenants')
+    os.environ['JINJA_CACHE_DIR'] = os.path.join(pasta, 'jinja_cache')
+    sys.path.insert(0, RAIZ)
+    from werkzeug.security import generate_password_hash
+    from app import app
+    from models import db, User, Turma, Aula
+    from tenants import tenant
+
+    rnd = random.Random(42)
+    hoje = date.today()
+    senha = generate_password_hash(SENHA, method='pbkdf2:sha256')
+    mapa = {}
+    with app.app_context():
+        for n in range(usuarios):
+            user = User(email=f'carga{n}@teste', nome=f'Carga {n}', password=senha)
+            db.session.add(user)
+            db.session.commit()
+            with tenant(user.id):
+                turmas = [Turma(user_id=user.id, nome=f'Turma {n}-{t}', ativa=True) for t in range(turmas_por_usuario)]
+                db.session.add_all(turmas)
+                db.session.flush()
+                aulas = []
+                for turma in turmas:
+                    for i in range(aulas_por_turma):
+                        aulas.append(Aula(
+                            turma_id=turma.id, professor_id=user.id,
+                            titulo=f'Aula {i + 1} - {turma.nome}',
+                            data=hoje + timedelta(days=rnd.randint(-120, 120)),
+                            turno=rnd.choice(['Manhã', 'Tarde', 'Noite']),
+                            status=rnd.choice(['Planejando', 'Preparar', 'Pronta', 'Entregue']),
+                            numero_aula=i + 1,
+                        ))
+                db.session.add_all(aulas)
+                db.session.commit()
+                mapa[user.email] = {
+                    'turmas': [t.id for t in turmas],
+                    'aulas': [a.id for a in aulas],
+                }
+        db.engine.dispose()
+    return mapa
+
+
+# ------------------------------------------------------------------
+# Servidor
+# ------------------------------------------------------------------
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_config(texto):
+    forma, _, classe = texto.partition(':')
+    workers, _, threads = forma.partition('x')
+    return {'workers': int(workers), 'threads': int(threads or 1), 'classe': classe or 'sync'}
+
+
+def subir_gunicorn(config, pasta, porta, env_extra):
+    env = dict(os.environ)
+    env.update(env_extra)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(pasta, 'planner.db')}",
+        'BACKUP_LOCAL_DIR': os.path.join(pasta, 'backups'),
+        'TENANT_DIR': os.path.join(pasta, 'tenants'),
+        'JINJA_CACHE_DIR': os.path.join(pasta, 'jinja_cache'),
+    })
+    cmd = [
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--bind', f'127.0.0.1:{porta}',
+        '--workers', str(config['workers']),
+        '--threads', str(config['threads']),
+        '--worker-class', config['classe'],
+        '--log-level', 'warning',
+    ]
+    proc = subprocess.Popen(cmd, cwd=RAIZ, env=env)
+    limite = time.time() + 60
+    while time.time() < limite:
+        if proc.poll() is not None:
+            raise RuntimeError(f'gunicorn terminou ao subir (código {proc.returncode})')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{porta}/login', timeout=2).read()
+            return proc
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.3)
+    proc.terminate()
+    raise RuntimeError('gunicorn não respondeu em 60s')
+
+
+# ------------------------------------------------------------------
+# Cliente
+# ------------------------------------------------------------------
+
+class _SemRedirect(urllib.request.HTTPRedirectHandler):
+    # Mede só a requisição em si; o 302 de resposta conta como sucesso
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Resultados:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tempos = {}
+        self.erros = {}
+
+    def registrar(self, rota, segundos, ok):
+        with self.lock:
+            self.tempos.setdefault(rota, []).append(segundos)
+            if not ok:
+                self.erros[rota] = self.erros.get(rota, 0) + 1
+
+
+class UsuarioVirtual:
+    def __init__(self, base, email, ids, resultados, rnd):
+        self.base = base
+        self.email = email
+        self.ids = ids
+        self.resultados = resultados
+        self.rnd = rnd
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SemRedirect()
+        )
+
+    def _req(self, rota, caminho, dados=None):
+        corpo = urllib.parse.urlencode(dados).encode() if dados is not None else None
+        inicio = time.perf_counter()
+        ok, conteudo = True, b''
+        try:
+            with self.opener.open(self.base + caminho, data=corpo, timeout=30) as resp:
+                conteudo = resp.read()
+        except urllib.error.HTTPError as e:
+            e.read()
+            ok = e.code < 400
+        except Exception:
+            ok = False
+        self.resultados.registrar(rota, time.perf_counter() - inicio, ok)
+        return conteudo
+
+    def login(self):
+        self._req('login', '/login', {'email': self.email, 'password': SENHA})
+
+    def dashboard_semana(self):
+        self._req('dashboard_semana', '/?view=semanal')
+
+    def dashboard_navegar(self):
+        self._req('dashboard_navegar', f'/?view=semanal&offset={self.rnd.randint(-8, 8)}')
+
+    def dashboard_mes(self):
+        self._req('dashboard_mes', f'/?view=mensal&offset={self.rnd.randint(-3, 3)}')
+
+    def gerenciar(self):
+        self._req('gerenciar', f'/gerenciar_aulas?page={self.rnd.randint(1, 5)}')
+
+    def gerenciar_filtro(self):
+        filtros = [('turma_id', self.rnd.choice(self.ids['turmas']))]
+        filtros += [('status', s) for s in self.rnd.sample(['Planejando', 'Preparar', 'Pronta', 'Entregue'], 2)]
+        if self.rnd.random() < 0.3:
+            filtros.append(('search', f'Aula {self.rnd.randint(1, 9)}'))
+        self._req('gerenciar_filtro', '/gerenciar_aulas?' + urllib.parse.urlencode(filtros))
+
+    def get_aula(self):
+        return self._req('get_aula', f'/aula/detalhes/{self.rnd.choice(self.ids["aulas"])}')
+
+    def editar_aula(self):
+        try:
+            aula = json.loads(self.get_aula() or b'{}')
+        except ValueError:
+            return
+        if 'id' not in aula:
+            return
+        campos = {k: ('' if v is None else v) for k, v in aula.items()
+                  if k not in ('turma_nome', 'codigo', 'id')}
+        campos['aula_id'] = aula['id']
+        campos['status'] = self.rnd.choice(['Planejando', 'Preparar', 'Pronta', 'Entregue'])
+        self._req('editar_aula', '/aula/editar', campos)
+
+    def rodar(self, ate):
+        acoes = [a for a, _ in MIX]
+        pesos = [p for _, p in MIX]
+        self.login()
+        while time.time() < ate:
+            getattr(self, self.rnd.choices(acoes, pesos)[0])()
+
+
+# ------------------------------------------------------------------
+# Relatório
+# ------------------------------------------------------------------
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def resumir(resultados, duracao):
+    rotas = {}
+    todos = []
+    for rota, tempos in sorted(resultados.tempos.items()):
+        todos.extend(tempos)
+        rotas[rota] = {
+            'requisicoes': len(tempos),
+            'erros': resultados.erros.get(rota, 0),
+            'p50_ms': round(percentil(tempos, 50) * 1000, 1),
+            'p95_ms': round(percentil(tempos, 95) * 1000, 1),
+            'p99_ms': round(percentil(tempos, 99) * 1000, 1),
+        }
+    return {'requisicoes': len(todos), 'req_por_s': round(len(todos) / duracao, 1),
+            'erros': sum(resultados.erros.values()),
+            'p95_ms': round(percentil(todos, 95) * 1000, 1) if todos else 0, 'rotas': rotas}
+
+
+def imprimir(nome, resumo):
+    print(f"\n=== {nome}: {resumo['req_por_s']} req/s, {resumo['requisicoes']} requisições, {resumo['erros']} erro(s)")
+    print(f"{'rota':<20}{'n':>8}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for rota, r in resumo['rotas'].items():
+        print(f"{rota:<20}{r['requisicoes']:>8}{r['erros']:>7}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--matriz', default='2x2,4x1,1x4,4x4', help='configurações do gunicorn, separadas por vírgula')
+    parser.add_argument('--concorrencia', type=int, default=8, help='usuários virtuais simultâneos')
+    parser.add_argument('--duracao', type=float, default=20, help='segundos de carga por configuração')
+    parser.add_argument('--usuarios', type=int, default=8, help='usuários cadastrados na massa de dados')
+    parser.add_argument('--turmas', type=int, default=4, help='turmas por usuário')
+    parser.add_argument('--aulas', type=int, default=60, help='aulas por turma')
+    parser.add_argument('--json', help='grava os resultados neste arquivo')
+    parser.add_argument('--manter', action='store_true', help='não apaga a pasta temporária no final')
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix='planner-carga-')
+    env_extra = {'SECRET_KEY': os.getenv('SECRET_KEY') or 'teste-de-carga', 'BACKUP_BACKEND': 'local'}
+    os.environ.update(env_extra)
+    semente = os.path.join(pasta, 'semente')
+    os.makedirs(semente)
+    print(f'Populando {args.usuarios} usuário(s) x {args.turmas} turma(s) x {args.aulas} aula(s) em {pasta}...')
+    mapa = popular(semente, args.usuarios, args.turmas, args.aulas)
+    emails = sorted(mapa)
+
+    relatorio = {}
+    try:
+        for texto in args.matriz.split(','):
+            config = parse_config(texto.strip())
+            nome = f"{config['workers']}x{config['threads']}:{config['classe']}"
+            # Cada configuração parte da mesma massa (as edições não se acumulam)
+            execucao = os.path.join(pasta, nome.replace(':', '_'))
+            shutil.copytree(semente, execucao)
+            porta = porta_livre()
+            proc = subir_gunicorn(config, execucao, porta, env_extra)
+            try:
+                resultados = Resultados()
+                ate = time.time() + args.duracao
+                threads = [
+                    threading.Thread(target=UsuarioVirtual(
+                        f'http://127.0.0.1:{porta}', emails[i % len(emails)], mapa[emails[i % len(emails)]],
+                        resultados, random.Random(i)
+                    ).rodar, args=(ate,))
+                    for i in range(args.concorrencia)
+                ]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            relatorio[nome] = resumir(resultados, args.duracao)
+            imprimir(nome, relatorio[nome])
+    finally:
+        if not args.manter:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+    print(f"\n{'configuração':<20}{'req/s':>10}{'p95 ms':>10}{'erros':>8}")
+    for nome, r in relatorio.items():
+        print(f"{nome:<20}{r['req_por_s']:>10}{r['p95_ms']:>10}{r['erros']:>8}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Verifica o isolamento entre tenants: dois professores cadastram turmas e aulas com
+marcadores únicos e cada um percorre as rotas de leitura (e consulta o banco dentro
+do próprio tenant) conferindo que o marcador do outro nunca aparece.
+
+Uso (na raiz do projeto):
+    python scripts/verificar_tenants.py                 # usuario e bucket
+    python scripts/verificar_tenants.py --modo bucket
+
+No modo bucket TENANT_BUCKETS=1, para os dois caírem no mesmo arquivo e o teste
+cobrir os filtros por usuário, não só a separação por arquivo. Cada modo roda num
+processo novo (o TENANT_MODE é lido quando o app é importado). Sai com código 1
+se algum dado vazar.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODOS = ('usuario', 'bucket')
+
+
+def _preparar_ambiente(pasta, modo):
+    os.environ['SECRET_KEY'] = 'verificar'
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(pasta, 'diretorio.db')}"
+    os.environ['BACKUP_BACKEND'] = 'local'
+    os.environ['BACKUP_LOCAL_DIR'] = os.path.join(pasta, 'backups')
+    os.environ['JINJA_CACHE_DIR'] = os.path.join(pasta, 'jinja_cache')
+    os.environ['TENANT_MODE'] = modo
+    os.environ['TENANT_DIR'] = os.path.join(pasta, 'tenants')
+    os.environ['TENANT_BUCKETS'] = '1'
+    sys.path.insert(0, RAIZ)
+
+
+def _professor(app, email):
+    """Cadastra o professor com uma turma e uma aula marcadas; retorna (cliente, marcador)."""
+    marcador = f"ISOLAMENTO{uuid.uuid4().hex[:10]}"
+    cliente = app.test_client()
+    cliente.post('/register', data={'email': email, 'password': 'p', 'nome': marcador})
+    cliente.post('/turmas/nova', data={'nome': f'Turma {marcador}', 'ativa': '1'})
+    turma_id = cliente.get('/api/changes?since=0').get_json()['alteracoes'][-1]['id']
+    cliente.post('/criar_aula', data={
+        'turma_id': str(turma_id), 'titulo': f'Aula {marcador}', 'data': '2030-01-02',
+        'turno': 'Noite', 'status': 'Pronta', 'ministrante_id': 'me', 'sala': marcador,
+    })
+    return cliente, marcador
+
+
+def _rotas(cliente):
+    yield '/turmas'
+    yield '/gerenciar_aulas'
+    yield '/?view=mensal&mes=1&ano=2030'
+    yield '/aulas/exportar'
+    yield '/api/changes'
+    # Ids baixos cobrem as aulas dos dois (no modo usuario os ids se repetem entre arquivos)
+    yield '/api/aulas/batch?ids=' + ','.join(str(i) for i in range(1, 11))
+    for i in range(1, 6):
+        yield f'/get_aula/{i}'
+        yield f'/turmas/imprimir/{i}'
+
+
+def verificar(pasta, modo):
+    """Modo filho: roda a verificação e retorna a lista de vazamentos encontrados."""
+    _preparar_ambiente(pasta, modo)
+    from app import app
+    from models import db, Turma, Aula
+    import tenants
+
+    app.config['TESTING'] = True
+    professores = {email: _professor(app, email) for email in ('a@isolamento', 'b@isolamento')}
+
+    vazamentos = []
+    for email, (cliente, proprio) in professores.items():
+        outros = [m for e, (_, m) in professores.items() if e != email]
+        texto = cliente.get('/turmas').get_data(as_text=True)
+        if proprio not in texto:
+            vazamentos.append(f"[{modo}] {email}: a própria turma não aparece em /turmas (verificação inválida)")
+        for rota in _rotas(cliente):
+            texto = cliente.get(rota).get_data(as_text=True)
+            for marcador in outros:
+                if marcador in texto:
+                    vazamentos.append(f"[{modo}] {email} viu dados de outro professor em {rota}")
+
+    # Consulta direta: dentro do tenant de um, as consultas filtradas por ele não veem o outro
+    with app.app_context():
+        from models import User
+        for usuario in User.query.all():
+            with tenants.tenant(usuario.id):
+                titulos = [a.titulo for a in Aula.query.join(Aula.turma).filter(Turma.user_id == usuario.id)]
+            for outro in User.query.filter(User.id != usuario.id):
+                if any(outro.nome in t for t in titulos):
+                    vazamentos.append(f"[{modo}] consulta no tenant de {usuario.email} trouxe aulas de {outro.email}")
+        db.session.remove()
+    return vazamentos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modo', choices=MODOS, help='Só este modo (padrão: os dois).')
+    parser.add_argument('--_pasta', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._pasta:
+        vazamentos = verificar(args._pasta, args.modo)
+        for v in vazamentos:
+            print(v)
+        sys.exit(1 if vazamentos else 0)
+
+    falhou = False
+    for modo in ([args.modo] if args.modo else MODOS):
+        pasta = tempfile.mkdtemp(prefix=f'verificar_tenants_{modo}_')
+        saida = subprocess.run(
+            [sys.executable, __file__, '--modo', modo, '--_pasta', pasta],
+            capture_output=True, text=True, cwd=RAIZ,
+        )
+        erros = [linha for linha in saida.stdout.splitlines() if linha.startswith('[')]
+        if saida.returncode:
+            falhou = True
+            print(f"{modo}: FALHOU")
+            for linha in erros or saida.stderr.strip().splitlines()[-5:]:
+                print(f"  {linha}")
+        else:
+            print(f"{modo}: ok (nenhum dado de outro professor nas rotas nem nas consultas do tenant)")
+    sys.exit(1 if falhou else 0)
+
+
+if __name__ == '__main__':
+    main()
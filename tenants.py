@@ -0,0 +1,256 @@
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from sqlalchemy.sql.util import find_tables
+from flask import g
+from flask_sqlalchemy.session import Session as FlaskSession
+
+import replica
+
+# Tabelas com os dados de cada professor; no modo tenant vivem no arquivo dele.
+# As demais (user, tokens, operações do Drive) ficam no banco "diretório" compartilhado.
+TABELAS_TENANT = {
+    'turma', 'aula', 'aula_arquivada', 'professor_adjunto', 'resumo_turma', 'versao_dados',
+    'alteracao', 'corte_alteracao',
+}
+
+_config = {'modo': None, 'buckets': 0, 'diretorio': None}
+_engines = {}
+_engines_lock = threading.Lock()
+_tenant_atual = ContextVar('tenant_atual', default=None)
+
+
+def configurar(app):
+    """
+    TENANT_MODE: vazio (desligado, um banco só), "usuario" (um arquivo SQLite por
+    usuário) ou "bucket" (TENANT_BUCKETS arquivos, usuário vai para id % N).
+    """
+    modo = (app.config.get('TENANT_MODE') or '').strip().lower() or None
+    if modo not in (None, 'usuario', 'bucket'):
+        raise ValueError(f'TENANT_MODE inválido: {modo}')
+    _config['modo'] = modo
+    _config['buckets'] = int(app.config.get('TENANT_BUCKETS') or 16)
+    _config['diretorio'] = app.config.get('TENANT_DIR') or os.path.join(app.instance_path, 'tenants')
+    if modo:
+        os.makedirs(_config['diretorio'], exist_ok=True)
+
+
+def modo_ativo():
+    return _config['modo'] is not None
+
+
+def chave_tenant(user_id):
+    if _config['modo'] == 'bucket':
+        return f"bucket_{int(user_id) % _config['buckets']:03d}"
+    return f'user_{int(user_id)}'
+
+
+def tabelas_tenant(metadata):
+    return [t for t in metadata.sorted_tables if t.name in TABELAS_TENANT]
+
+
+def tabelas_diretorio(metadata):
+    return [t for t in metadata.sorted_tables if t.name not in TABELAS_TENANT]
+
+
+def preparar_schema(engine, metadata):
+    """Cria as tabelas de tenant que faltam, as colunas e os índices novos (migração simples)."""
+    from models import criar_colunas_faltantes, criar_autoincremento_aula  # models importa este módulo
+
+    tabelas = tabelas_tenant(metadata)
+    metadata.create_all(engine, tables=tabelas)
+    criar_colunas_faltantes(engine, tabelas)
+    criar_autoincremento_aula(engine)
+    for tabela in tabelas:
+        for indice in tabela.indexes:
+            indice.create(bind=engine, checkfirst=True)
+
+
+def engine_do_tenant(chave, metadata):
+    engine = _engines.get(chave)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(chave)
+        if engine is None:
+            caminho = os.path.join(_config['diretorio'], f'{chave}.db')
+            engine = sa.create_engine(f'sqlite:///{caminho}')
+            preparar_schema(engine, metadata)
+            replica.preparar_primario(engine)
+            _engines[chave] = engine
+    return engine
+
+
+def migrar_usuario(origem, metadata, user_id):
+    """
+    Copia as linhas do usuário das tabelas de tenant do banco único (origem) para o
+    arquivo do tenant, mantendo os ids. Retorna quantas linhas copiou, ou None se o
+    tenant já tiver turmas desse usuário (migração já feita).
+    """
+    destino = engine_do_tenant(chave_tenant(user_id), metadata)
+    tabelas = {t.name: t for t in tabelas_tenant(metadata)}
+    turma = tabelas['turma']
+
+    with destino.connect() as conn:
+        if conn.execute(sa.select(turma.c.id).where(turma.c.user_id == user_id).limit(1)).first():
+            return None
+
+    existentes = set(sa.inspect(origem).get_table_names())
+    copiados = 0
+    with origem.connect() as leitura, destino.begin() as escrita:
+        turma_ids = sa.select(turma.c.id).where(turma.c.user_id == user_id)
+        filtros = {
+            'professor_adjunto': lambda t: t.c.user_id == user_id,
+            'turma': lambda t: t.c.user_id == user_id,
+            'aula': lambda t: t.c.turma_id.in_(turma_ids),
+            'aula_arquivada': lambda t: t.c.turma_id.in_(turma_ids),
+            # Mantém a versão para os ETags já entregues continuarem válidos
+            'versao_dados': lambda t: t.c.user_id == user_id,
+            # resumo_turma fica de fora: é recalculado depois da cópia
+        }
+        for nome, tabela in tabelas.items():
+            if nome not in filtros or nome not in existentes:
+                continue
+            colunas = [c.name for c in tabela.columns]
+            linhas = leitura.execute(sa.select(*tabela.columns).where(filtros[nome](tabela))).all()
+            if linhas:
+                escrita.execute(sa.insert(tabela), [dict(zip(colunas, l)) for l in linhas])
+                copiados += len(linhas)
+    return copiados
+
+
+def chave_atual():
+    return _tenant_atual.get()
+
+
+@contextmanager
+def usar_chave(chave):
+    """Ativa um tenant pela chave (usado para levar o tenant da requisição a outra thread)."""
+    token = _tenant_atual.set(chave)
+    try:
+        yield
+    finally:
+        _tenant_atual.reset(token)
+
+
+def tenant(user_id):
+    """Direciona as consultas às tabelas de tenant para o banco do usuário informado."""
+    return usar_chave(chave_tenant(user_id) if user_id is not None else None)
+
+
+def definir_tenant_da_requisicao(user_id):
+    """Como tenant(), mas vale até o fim da requisição (inclusive respostas em streaming)."""
+    encerrar_tenant_da_requisicao()
+    g._tenant_token = _tenant_atual.set(chave_tenant(user_id))
+
+
+def encerrar_tenant_da_requisicao(exc=None):
+    token = g.pop('_tenant_token', None)
+    if token is not None:
+        _tenant_atual.reset(token)
+
+
+def iterar_com_tenant(user_id, gerador):
+    """
+    Respostas em streaming continuam depois do teardown da requisição; o tenant é
+    reativado a cada pedaço gerado.
+    """
+    chave = chave_tenant(user_id)
+    try:
+        while True:
+            with usar_chave(chave):
+                try:
+                    pedaco = next(gerador)
+                except StopIteration:
+                    return
+            yield pedaco
+    finally:
+        gerador.close()
+
+
+def _tabela_alvo(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name
+    if clause is not None:
+        for tabela in find_tables(clause, include_crud=True):
+            if getattr(tabela, 'name', None) in TABELAS_TENANT:
+                return tabela.name
+    return None
+
+
+class EscritaEmDoisBancos(RuntimeError):
+    """Uma mesma transação tentou gravar no diretório e no banco do tenant."""
+
+
+class RoteadorSession(FlaskSession):
+    """
+    Sessão que escolhe o banco do tenant atual para as tabelas de dados do professor
+    e, nas rotas somente leitura, o engine de leitura (réplica) em vez do primário.
+
+    MENTORIA: com TENANT_MODE ligado, diretório e tenant são arquivos SQLite
+    diferentes e o commit seria uma transação em cada um: se o segundo falhar, os
+    dois ficam fora de sincronia (não há commit em duas fases no SQLite). Por isso
+    cada unidade de trabalho só pode gravar num dos bancos; misturar os dois
+    levanta EscritaEmDoisBancos antes de qualquer commit. Quem precisa mexer nos
+    dois faz dois commits, na ordem em que uma falha no meio é inofensiva (ex.:
+    excluir_turma apaga primeiro os tokens do feed, no diretório, depois a turma).
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, escrita=False, **kwargs):
+        if bind is not None:
+            return bind
+        if modo_ativo() and _tabela_alvo(mapper, clause) in TABELAS_TENANT:
+            chave = _tenant_atual.get()
+            if chave is None:
+                raise RuntimeError('Consulta a dados de professor sem tenant definido.')
+            engine = engine_do_tenant(chave, self._db.metadata)
+        else:
+            engine = super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+        # Objetos do flush são conferidos em _conferir_bancos (aqui o flush também pede
+        # conexão para objetos sem mudança, como o User de uma turma apagada)
+        if escrita or getattr(clause, 'is_dml', False):
+            self._registrar_escrita(engine)
+
+        # Flush e comandos de escrita sempre vão para o primário
+        if (replica.ativo() and replica.em_leitura() and not escrita and not self._flushing
+                and not getattr(clause, 'is_dml', False) and isinstance(engine, sa.engine.Engine)):
+            return replica.engine_de_leitura(engine, self._db.engine)
+        return engine
+
+    def _registrar_escrita(self, engine):
+        if not modo_ativo():
+            return
+        gravados = self.info.setdefault('_engines_escrita', set())
+        gravados.add(engine)
+        if len(gravados) > 1:
+            raise EscritaEmDoisBancos(
+                'A transação grava no diretório e no banco do tenant; faça um commit para cada.'
+            )
+
+
+@sa.event.listens_for(RoteadorSession, 'before_flush')
+def _conferir_bancos(session, flush_context, instances):
+    # Antes de qualquer SQL do flush: se misturar os bancos, nada é gravado
+    if not modo_ativo():
+        return
+    alterados = list(session.new) + list(session.deleted) + [
+        obj for obj in session.dirty if session.is_modified(obj, include_collections=False)
+    ]
+    for obj in alterados:
+        session._registrar_escrita(session.get_bind(mapper=sa.inspect(obj).mapper))
+
+
+@sa.event.listens_for(RoteadorSession, 'after_flush')
+def _marcar_escrita(session, flush_context):
+    replica.marcar_escrita()
+
+
+@sa.event.listens_for(RoteadorSession, 'after_transaction_end')
+def _esquecer_engines(session, transacao):
+    # Commit ou rollback da transação principal: a próxima começa do zero
+    if transacao.parent is None:
+        session.info.pop('_engines_escrita', None)
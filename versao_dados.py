@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+
+from models import db, Turma, Aula, ProfessorAdjunto, VersaoDados
+
+
+def incrementar_versoes(conn, user_ids):
+    """Incrementa a versão dos dados dos usuários informados usando a conexão dada."""
+    user_ids = {int(u) for u in user_ids if u is not None}
+    if not user_ids:
+        return
+    tabela = VersaoDados.__table__
+    agora = datetime.now()
+
+    existentes = set(conn.execute(select(tabela.c.user_id).where(tabela.c.user_id.in_(user_ids))).scalars())
+    if existentes:
+        conn.execute(
+            update(tabela)
+            .where(tabela.c.user_id.in_(existentes))
+            .values(versao=tabela.c.versao + 1, atualizado_em=agora)
+        )
+    novos = user_ids - existentes
+    if novos:
+        conn.execute(insert(tabela), [{'user_id': u, 'versao': 1, 'atualizado_em': agora} for u in novos])
+
+
+def versao_do_usuario(user_id):
+    """Retorna (versao, atualizado_em) do usuário; (0, None) se ele nunca escreveu nada."""
+    linha = db.session.execute(
+        select(VersaoDados.versao, VersaoDados.atualizado_em).where(VersaoDados.user_id == user_id)
+    ).first()
+    return tuple(linha) if linha else (0, None)
+
+
+def _usuarios_alterados(session):
+    user_ids = set()
+    turmas_sem_dono = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Turma, ProfessorAdjunto)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Aula):
+            if obj.professor_id:
+                user_ids.add(obj.professor_id)
+            else:
+                turmas_sem_dono.add(obj.turma_id)
+
+    # Aulas antigas sem professor_id: o dono vem da turma
+    turmas_sem_dono.discard(None)
+    if turmas_sem_dono:
+        tabela = Turma.__table__
+        conn = session.connection(bind_arguments={'mapper': Turma})
+        user_ids.update(conn.execute(
+            select(tabela.c.user_id).where(tabela.c.id.in_(turmas_sem_dono))
+        ).scalars())
+    return user_ids
+
+
+@event.listens_for(Session, 'after_flush')
+def _manter_versao(session, flush_context):
+    # A conexão só é pedida se houve escrita em dados do professor (no modo
+    # tenant, um flush só de User não tem banco de tenant para usar)
+    user_ids = _usuarios_alterados(session)
+    if user_ids:
+        incrementar_versoes(session.connection(bind_arguments={'mapper': VersaoDados}), user_ids)
@@ -0,0 +1,89 @@
+import calendar
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from sqlalchemy import select, func
+
+from models import db, Turma, Aula
+from resumo_turmas import STATUS_COLUNAS
+from versao_dados import versao_do_usuario
+
+TURNOS = ['Manhã', 'Tarde', 'Noite']
+MESES = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+
+# Quantos (usuário, ano, versão) ficam em memória por processo
+MAX_CACHE = 256
+
+_cache = OrderedDict()
+_trava = threading.Lock()
+
+
+def _contar(user_id, ano):
+    """Um GROUP BY por (data, status, turno): centenas de tuplas em vez de milhares de aulas."""
+    linhas = db.session.execute(
+        select(Aula.data, Aula.status, Aula.turno, func.count())
+        .join(Turma, Turma.id == Aula.turma_id)
+        .where(Turma.user_id == user_id, Turma.ativa == True,
+               Aula.data >= date(ano, 1, 1), Aula.data <= date(ano, 12, 31))
+        .group_by(Aula.data, Aula.status, Aula.turno)
+    ).all()
+
+    dias = {}
+    for data, status, turno, qtd in linhas:
+        dia = dias.setdefault(data.strftime('%Y-%m-%d'), {
+            'total': 0,
+            'status': {s: 0 for s in STATUS_COLUNAS},
+            'turno': {t: 0 for t in TURNOS},
+        })
+        # Mesmas regras do painel: status desconhecido conta como Planejando, turno como Noite
+        dia['status'][status if status in STATUS_COLUNAS else 'Planejando'] += qtd
+        dia['turno'][turno if turno in TURNOS else 'Noite'] += qtd
+        dia['total'] += qtd
+    return dias
+
+
+def contagens_do_ano(user_id, ano):
+    """
+    {'AAAA-MM-DD': {'total', 'status': {...}, 'turno': {...}}} das turmas ativas.
+    A versão dos dados entra na chave: qualquer escrita do usuário invalida o cache.
+    """
+    chave = (user_id, ano, versao_do_usuario(user_id)[0])
+    with _trava:
+        if chave in _cache:
+            _cache.move_to_end(chave)
+            return _cache[chave]
+
+    dias = _contar(user_id, ano)
+    with _trava:
+        _cache[chave] = dias
+        while len(_cache) > MAX_CACHE:
+            _cache.popitem(last=False)
+    return dias
+
+
+def montar_ano(ano, dias):
+    """Meses do ano em semanas (domingo primeiro) com a intensidade 0-4 de cada dia."""
+    maximo = max((d['total'] for d in dias.values()), default=0)
+    cal = calendar.Calendar(firstweekday=6)
+    meses = []
+    for mes in range(1, 13):
+        semanas = []
+        for semana in cal.monthdatescalendar(ano, mes):
+            linha = []
+            for dia in semana:
+                if dia.month != mes:
+                    linha.append(None)
+                    continue
+                full_date = dia.strftime('%Y-%m-%d')
+                contagem = dias.get(full_date)
+                total = contagem['total'] if contagem else 0
+                linha.append({
+                    'day': dia.day,
+                    'full_date': full_date,
+                    'contagem': contagem,
+                    'nivel': -(-4 * total // maximo) if total else 0,
+                })
+            semanas.append(linha)
+        meses.append({'mes': mes, 'nome': MESES[mes - 1], 'semanas': semanas})
+    return meses